@@ -1,16 +1,26 @@
+import time
+_startup_t0 = time.perf_counter()
+
+import os
 import math
 import asyncio
 from pathlib import Path
 from typing import Optional
-from datetime import datetime
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timedelta
 from typing import Dict, List
 from utils import normalize_email
 from sqlalchemy import func, select
 from sqlalchemy.orm import Session, aliased
 from fastapi.staticfiles import StaticFiles
+from starlette.concurrency import run_in_threadpool
 from fastapi.templating import Jinja2Templates
-from database import SessionLocal, engine, Base
-from mail_notification import send_invoice_email
+from jinja2 import FileSystemBytecodeCache
+from database import SessionLocal, engine
+from migrations import migrate
+from purchase_search import MAX_MATCHES, index_purchase, reindex_product, search_purchases
+from stock_ledger import DEFAULT_JOURNAL, StockLedger
+from pricing import build_line_items, price_lines, rupees
 from fastapi.responses import HTMLResponse, RedirectResponse
 from models import Product, Purchase, PurchaseItem, Denomination
 from fastapi import FastAPI, Depends, Request, Form, HTTPException, status, BackgroundTasks, Query
@@ -18,7 +28,34 @@ from fastapi import FastAPI, Depends, Request, Form, HTTPException, status, Back
 
 BASE_DIR = Path(__file__).resolve().parent
 
-Base.metadata.create_all(bind=engine)
+# Optional write-behind stock ledger for hot SKUs (see stock_ledger.py)
+USE_STOCK_LEDGER = os.getenv("BILLING_STOCK_LEDGER", "").lower() in ("1", "true", "yes")
+LEDGER_FLUSH_SECONDS = float(os.getenv("BILLING_LEDGER_FLUSH_SECONDS", "1.0"))
+LEDGER_JOURNAL = Path(os.getenv("BILLING_LEDGER_JOURNAL", str(DEFAULT_JOURNAL)))
+stock_ledger: Optional[StockLedger] = None
+
+# Processes used to render invoices for the admin bulk-resend job
+RESEND_WORKERS = int(os.getenv("BILLING_RESEND_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+# Fast-start mode for autoscaled workers: templates are compiled once into a
+# persistent bytecode cache and all of them are loaded at startup, so the first
+# request does not pay for it. The mail stack is always imported on first use.
+FAST_START = os.getenv("BILLING_FAST_START", "").lower() in ("1", "true", "yes")
+JINJA_CACHE_DIR = Path(os.getenv("BILLING_JINJA_CACHE", str(BASE_DIR / ".jinja_cache")))
+
+# Seconds spent per startup stage, printed once startup is done
+startup_timings: Dict[str, float] = {"imports": time.perf_counter() - _startup_t0}
+
+@contextmanager
+def startup_stage(name: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        startup_timings[name] = time.perf_counter() - started
+
+with startup_stage("schema"):
+    migrate(engine)  # no-op when the stored schema version is current
 
 app = FastAPI(title="Mini Billing (FastAPI)")
 # templates = Jinja2Templates(directory="templates")
@@ -26,6 +63,16 @@ app = FastAPI(title="Mini Billing (FastAPI)")
 # Use absolute paths
 app.mount("/static", StaticFiles(directory=str(BASE_DIR / "static")), name="static")
 templates = Jinja2Templates(directory=str(BASE_DIR / "templates"))
+if FAST_START:
+    JINJA_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    templates.env.bytecode_cache = FileSystemBytecodeCache(str(JINJA_CACHE_DIR))
+
+def precompile_templates() -> int:
+    """Load every template into the environment (and the bytecode cache)."""
+    names = templates.env.list_templates(extensions=["html"])
+    for name in names:
+        templates.env.get_template(name)
+    return len(names)
 
 def get_db():
     db = SessionLocal()
@@ -34,6 +81,10 @@ def get_db():
     finally:
         db.close()
 
+def ledger_editing(product_pk: int):
+    """Wrap direct writes to a product's stock so the ledger stays in sync."""
+    return stock_ledger.editing(product_pk) if stock_ledger else nullcontext()
+
 # -------------------------------
 # Simple Admin UI (Products only)
 # -------------------------------
@@ -58,7 +109,7 @@ def admin_products_new_form(request: Request):
     )
 
 @app.post("/admin/products/new")
-async def admin_products_create(
+def admin_products_create(
     request: Request,
     product_id: str = Form(...),
     name: str = Form(...),
@@ -85,6 +136,8 @@ async def admin_products_create(
     )
     db.add(obj)
     db.commit()
+    if stock_ledger:
+        stock_ledger.refresh(obj.id)
     return RedirectResponse(url="/admin/products", status_code=status.HTTP_303_SEE_OTHER)
 
 @app.get("/admin/products/{id}/edit", response_class=HTMLResponse)
@@ -98,7 +151,7 @@ def admin_products_edit_form(id: int, request: Request, db: Session = Depends(ge
     )
 
 @app.post("/admin/products/{id}/edit")
-async def admin_products_update(
+def admin_products_update(
     id: int,
     request: Request,
     product_id: str = Form(...),
@@ -122,13 +175,18 @@ async def admin_products_update(
     if exists:
         return HTMLResponse("product_id already exists", status_code=409)
 
-    product.product_id = product_id
-    product.name = name
-    product.available_stock = max(0, available_stock)
-    product.price_per_unit = max(0.0, price_per_unit)
-    product.tax_percentage = max(0.0, tax_percentage)
-
-    db.commit()
+    with ledger_editing(product.id):
+        renamed = (product.product_id, product.name) != (product_id, name)
+        product.product_id = product_id
+        product.name = name
+        product.available_stock = max(0, available_stock)
+        product.price_per_unit = max(0.0, price_per_unit)
+        product.tax_percentage = max(0.0, tax_percentage)
+
+        if renamed:
+            db.flush()
+            reindex_product(db, product.id)
+        db.commit()
     return RedirectResponse(url="/admin/products", status_code=status.HTTP_303_SEE_OTHER)
 
 @app.post("/admin/products/{id}/delete")
@@ -136,10 +194,71 @@ def admin_products_delete(id: int, db: Session = Depends(get_db)):
     product = db.query(Product).get(id)
     if not product:
         return HTMLResponse("Product not found", status_code=404)
-    db.delete(product)
-    db.commit()
+    with ledger_editing(product.id):
+        db.delete(product)
+        db.flush()
+        reindex_product(db, id)
+        db.commit()
     return RedirectResponse(url="/admin/products", status_code=status.HTTP_303_SEE_OTHER)
 
+# -------------------------------
+# Admin: bulk invoice resend
+# -------------------------------
+
+# State of the last/current resend job, shown on the admin page
+resend_job: Dict = {"running": False, "done": 0, "total": 0, "summary": None, "errors": []}
+
+def _run_resend_job(start, end, customer, resume):
+    def progress(done, total, purchase_id, error):
+        resend_job["done"], resend_job["total"] = done, total
+        if error:
+            resend_job["errors"].append(f"#{purchase_id}: {error}")
+
+    from resend_invoices import resend_invoices  # pulls in the mail stack
+
+    try:
+        resend_job["summary"] = resend_invoices(
+            start=start, end=end, customer=customer, resume=resume,
+            workers=RESEND_WORKERS, progress=progress,
+        )
+    except Exception as e:
+        resend_job["errors"].append(f"Job failed: {e}")
+    finally:
+        resend_job["running"] = False
+
+@app.get("/admin/invoices/resend", response_class=HTMLResponse)
+def admin_resend_form(request: Request):
+    return templates.TemplateResponse(
+        "admin_resend.html",
+        {"request": request, "job": resend_job}
+    )
+
+@app.post("/admin/invoices/resend")
+async def admin_resend_start(
+    background_tasks: BackgroundTasks,
+    start: str = Form(""),
+    end: str = Form(""),
+    customer: str = Form(""),
+    resend_all: str = Form(""),
+):
+    if resend_job["running"]:
+        return HTMLResponse("A resend job is already running", status_code=409)
+
+    try:
+        start_dt = datetime.strptime(start, "%Y-%m-%d") if start.strip() else None
+        # end date is inclusive in the form
+        end_dt = datetime.strptime(end, "%Y-%m-%d") + timedelta(days=1) if end.strip() else None
+    except ValueError:
+        return HTMLResponse("Dates must be YYYY-MM-DD", status_code=400)
+    customer = customer.strip() or None
+    if not (start_dt or end_dt or customer):
+        return HTMLResponse("Select a date range and/or a customer", status_code=400)
+
+    resend_job.update(running=True, done=0, total=0, summary=None, errors=[])
+    # resend_all: ignore what an interrupted run of this selection already sent
+    background_tasks.add_task(_run_resend_job, start_dt, end_dt, customer, not resend_all)
+    return RedirectResponse(url="/admin/invoices/resend", status_code=status.HTTP_303_SEE_OTHER)
+
 
 # @app.on_event("startup")
 # def startup_event():
@@ -164,10 +283,30 @@ def admin_products_delete(id: int, db: Session = Depends(get_db)):
 # --- Seed / Ensure initial data on startup ---
 @app.on_event("startup")
 def startup_event():
+    global stock_ledger
+    with startup_stage("seed"):
+        seed_initial_data()
+
+    if USE_STOCK_LEDGER:
+        with startup_stage("stock ledger"):
+            stock_ledger = StockLedger(engine, journal_path=LEDGER_JOURNAL, flush_interval=LEDGER_FLUSH_SECONDS)
+            stock_ledger.load()
+            stock_ledger.start()
+
+    if FAST_START:
+        with startup_stage("templates"):
+            count = precompile_templates()
+        print(f"[STARTUP] Precompiled {count} templates (bytecode cache: {JINJA_CACHE_DIR})")
+
+    total = time.perf_counter() - _startup_t0
+    stages = ", ".join(f"{name} {secs * 1000:.0f}ms" for name, secs in startup_timings.items())
+    print(f"[STARTUP] Ready in {total * 1000:.0f}ms ({stages})")
+
+def seed_initial_data():
     db = SessionLocal()
     try:
         # Seed sample products ONCE (only if none exist)
-        if db.query(Product).count() == 0:
+        if db.query(Product.id).first() is None:
             db.add_all([
                 Product(product_id="P1001", name="Pen",      available_stock=100, price_per_unit=10.0, tax_percentage=5.0),
                 Product(product_id="P1002", name="Notebook", available_stock=50,  price_per_unit=50.0, tax_percentage=12.0),
@@ -184,6 +323,13 @@ def startup_event():
             db.commit()
     finally:
         db.close()
+
+@app.on_event("shutdown")
+def shutdown_event():
+    global stock_ledger
+    if stock_ledger:
+        stock_ledger.stop()  # final flush of pending stock deltas
+        stock_ledger = None
         
 @app.get("/", include_in_schema=False)
 def root():
@@ -191,7 +337,7 @@ def root():
 
 # Billing page
 @app.get("/billing", response_class=HTMLResponse)
-async def billing_form(request: Request, db: Session = Depends(get_db)):
+def billing_form(request: Request, db: Session = Depends(get_db)):
     products = db.query(Product).order_by(Product.name.asc()).all()
     return templates.TemplateResponse("billing_form.html", {"request": request, "products": products})
 
@@ -199,7 +345,11 @@ async def billing_form(request: Request, db: Session = Depends(get_db)):
 @app.post("/generate_bill", response_class=HTMLResponse)
 async def generate_bill(request: Request, background_tasks: BackgroundTasks, db: Session = Depends(get_db)):
     form = await request.form()
+    # Everything after reading the form is blocking DB / SMTP work: run it in
+    # the threadpool so concurrent checkouts do not queue on the event loop
+    return await run_in_threadpool(_generate_bill, request, form, db)
 
+def _generate_bill(request: Request, form, db: Session):
     customer_email = (form.get("customer_email") or "").strip()
     if not customer_email:
         return HTMLResponse("Customer email is required", status_code=400)
@@ -230,33 +380,32 @@ async def generate_bill(request: Request, background_tasks: BackgroundTasks, db:
         return HTMLResponse("No items provided", status_code=400)
 
     # Validate, compute totals, check stock
-    total = 0.0
     details = []
     for row in items_raw:
         product = db.query(Product).filter(Product.product_id == row["product_id"]).first()
         if not product:
             return HTMLResponse(f"Product {row['product_id']} not found", status_code=400)
-        if product.available_stock < row["quantity"]:
+        available = stock_ledger.available(product.id) if stock_ledger else product.available_stock
+        if available < row["quantity"]:
             return HTMLResponse(
-                f"Insufficient stock for {product.name} (have {product.available_stock}, need {row['quantity']})",
+                f"Insufficient stock for {product.name} (have {available}, need {row['quantity']})",
                 status_code=400,
             )
-        amount = product.price_per_unit * row["quantity"]
-        tax_amount = amount * (product.tax_percentage / 100.0)
-        line_total = amount + tax_amount
-        total += line_total
         details.append({
             "product_obj": product,
             "name": product.name,
             "quantity": row["quantity"],
             "unit_price": product.price_per_unit,
             "tax_percent": product.tax_percentage,
-            "amount": amount,
-            "tax_amount": tax_amount,
-            "total": line_total,
         })
 
-    total = round(total, 2)
+    priced = price_lines([(d["unit_price"], d["quantity"], d["tax_percent"]) for d in details])
+    for d, amount, tax_amount, line_total in zip(details, priced.amount, priced.tax, priced.total):
+        d["amount"] = rupees(amount)
+        d["tax_amount"] = rupees(tax_amount)
+        d["total"] = rupees(line_total)
+
+    total = rupees(priced.net)
     if paid_amount < total:
         return HTMLResponse(f"Paid amount (₹{paid_amount:.2f}) is less than total (₹{total:.2f})", status_code=400)
 
@@ -272,7 +421,7 @@ async def generate_bill(request: Request, background_tasks: BackgroundTasks, db:
             balance_denoms[d.value] = c
             change_int %= d.value
 
-    # Persist purchase and items; decrement stock
+    # Persist purchase and items in one transaction; decrement stock
     purchase = Purchase(
         customer_email=customer_email,
         total_amount=total,
@@ -281,23 +430,50 @@ async def generate_bill(request: Request, background_tasks: BackgroundTasks, db:
         purchase_time=datetime.now(),
     )
     db.add(purchase)
-    db.commit()
-    db.refresh(purchase)
-
-    for d in details:
-        db.add(PurchaseItem(
-            purchase_id=purchase.id,
-            product_id=d["product_obj"].id,
-            quantity=d["quantity"],
-        ))
-        d["product_obj"].available_stock -= d["quantity"]
-    db.commit()
+    purchase_id = None
+    try:
+        db.flush()
+        purchase_id = purchase.id
+
+        # With the ledger, stock is taken atomically here, tagged with the
+        # purchase so a crash before the commit below is settled on restart
+        if stock_ledger:
+            reserved: Dict[int, int] = {}
+            for d in details:
+                pk = d["product_obj"].id
+                reserved[pk] = reserved.get(pk, 0) + d["quantity"]
+            shortage = stock_ledger.reserve(reserved, purchase_id)
+            if shortage:
+                db.rollback()
+                pk, have, need = shortage
+                name = next(d["name"] for d in details if d["product_obj"].id == pk)
+                return HTMLResponse(f"Insufficient stock for {name} (have {have}, need {need})", status_code=400)
+
+        for d in details:
+            db.add(PurchaseItem(
+                purchase_id=purchase_id,
+                product_id=d["product_obj"].id,
+                quantity=d["quantity"],
+            ))
+            if not stock_ledger:
+                d["product_obj"].available_stock -= d["quantity"]
+        db.flush()
+        index_purchase(db, purchase_id)
+        db.commit()
+    except Exception:
+        db.rollback()
+        if stock_ledger and purchase_id is not None:
+            stock_ledger.release(purchase_id)
+        raise
+    if stock_ledger:
+        stock_ledger.commit(purchase_id)
 
     # --- SEND EMAIL and build notice ---
     email_notice = None
     email_status = "success"
     try:
         # call your existing mailer; raise on error
+        from mail_notification import send_invoice_email  # imported on first bill
         send_invoice_email(customer_email, purchase.id)
         email_notice = f"Invoice emailed to {customer_email}"
         email_status = "success"
@@ -305,9 +481,9 @@ async def generate_bill(request: Request, background_tasks: BackgroundTasks, db:
         email_notice = f"Email failed: {e}"
         email_status = "error"
 
-    subtotal_before_tax = round(sum(d["amount"] for d in details), 2)
-    total_tax = round(sum(d["tax_amount"] for d in details), 2)
-    net_price = round(subtotal_before_tax + total_tax, 2)
+    subtotal_before_tax = rupees(priced.subtotal)
+    total_tax = rupees(priced.total_tax)
+    net_price = total
     rounded_down = float(int(net_price))  # whole-rupee floor
 
     return templates.TemplateResponse("bill_display.html", {
@@ -329,7 +505,7 @@ async def generate_bill(request: Request, background_tasks: BackgroundTasks, db:
 
 
 @app.get("/purchases", response_class=HTMLResponse)
-async def view_purchases(
+def view_purchases(
     request: Request,
     db: Session = Depends(get_db),
     customer: Optional[str] = Query(default=None)
@@ -400,8 +576,37 @@ async def view_purchases(
     })
 
 
+@app.get("/purchases/search", response_class=HTMLResponse)
+def search_purchases_view(
+    request: Request,
+    db: Session = Depends(get_db),
+    q: str = Query(default=""),
+    page: int = Query(default=1, ge=1),
+    per_page: int = Query(default=25, ge=1, le=200),
+):
+    """
+    /purchases/search?q=...
+      - matches partial customer email, product name/code and invoice number
+      - ranked best-first, paginated with ?page=
+      - past MAX_MATCHES matches only the newest are ranked ("1000+")
+    """
+    rows, total = search_purchases(db, q, page=page, per_page=per_page) if q.strip() else ([], 0)
+    pages = max(1, math.ceil(min(total, MAX_MATCHES) / per_page))
+
+    return templates.TemplateResponse("purchase_search.html", {
+        "request": request,
+        "q": q,
+        "rows": rows,
+        "total": min(total, MAX_MATCHES),
+        "more": total > MAX_MATCHES,
+        "page": page,
+        "pages": pages,
+        "per_page": per_page,
+    })
+
+
 @app.get("/customers", response_class=HTMLResponse)
-async def view_customers(
+def view_customers(
     request: Request,
     db: Session = Depends(get_db),
     customer: Optional[str] = Query(default=None)
@@ -445,7 +650,7 @@ async def view_customers(
     })
 
 @app.get("/products", response_class=HTMLResponse)
-async def view_products(
+def view_products(
     request: Request,
     db: Session = Depends(get_db),
     product: Optional[str] = Query(default=None),
@@ -457,7 +662,7 @@ async def view_products(
     """
 
     # --- Product list (unique, with aggregates) ---
-    prod_norm = func.lower(func.trim(PurchaseItem.product_name)).label("product")
+    prod_norm = func.lower(func.trim(Product.name)).label("product")
     products = (
         db.query(
             prod_norm,
@@ -466,6 +671,7 @@ async def view_products(
         )
         .select_from(PurchaseItem)
         .join(Purchase, Purchase.id == PurchaseItem.purchase_id)
+        .join(Product, Product.id == PurchaseItem.product_id)
         .group_by(prod_norm)
         .order_by(func.count(func.distinct(PurchaseItem.purchase_id)).desc(), prod_norm.asc())
         .all()
@@ -484,32 +690,36 @@ async def view_products(
         matching_purchases = (
             db.query(Purchase)
             .join(Purchase.items)  # Purchase -> PurchaseItem relationship
-            .filter(func.lower(func.trim(PurchaseItem.product_name)) == selected_product)
+            .join(PurchaseItem.product)
+            .filter(func.lower(func.trim(Product.name)) == selected_product)
             .order_by(Purchase.purchase_time.desc())
             .all()
         )
 
-        # Build per-purchase rows, but only for the selected product lines
-        for pur in matching_purchases:
-            focus_items = [
-                it for it in pur.items
-                if (it.product_name or "").strip().lower() == selected_product
-            ]
-
+        # Only the selected product's lines count, priced in one batch
+        # (lines of since-deleted products have no product and never match)
+        focus = [
+            [it for it in pur.items
+             if it.product is not None and (it.product.name or "").strip().lower() == selected_product]
+            for pur in matching_purchases
+        ]
+        priced = price_lines([
+            (it.product.price_per_unit, it.quantity, it.product.tax_percentage)
+            for focus_items in focus for it in focus_items
+        ])
+
+        # Build per-purchase rows from the batch, in the same order
+        pos = 0
+        for pur, focus_items in zip(matching_purchases, focus):
             qty_sum_pur = sum(int(it.quantity or 0) for it in focus_items)
-
-            rev_sum_pur = 0.0
-            for it in focus_items:
-                q = float(it.quantity or 0)
-                unit = float(it.price_per_unit or 0.0)
-                tax = float(it.tax_percentage or 0.0)
-                rev_sum_pur += q * unit * (1.0 + tax / 100.0)
+            rev_sum_pur = sum(priced.total[pos:pos + len(focus_items)])
+            pos += len(focus_items)
 
             product_rows.append({
                 "id": pur.id,
                 "purchase_time": pur.purchase_time,
                 "qty_for_product": qty_sum_pur,
-                "revenue_for_product": round(rev_sum_pur, 2),
+                "revenue_for_product": rupees(rev_sum_pur),
                 "total_amount_bill": pur.total_amount,  # full bill amount
                 "paid_amount": pur.paid_amount,
                 "balance": pur.balance,
@@ -517,9 +727,8 @@ async def view_products(
             })
 
             product_total_qty += qty_sum_pur
-            product_total_revenue += rev_sum_pur
 
-        product_total_revenue = round(product_total_revenue, 2)
+        product_total_revenue = rupees(priced.net)
 
     return templates.TemplateResponse("products.html", {
         "request": request,
@@ -532,41 +741,21 @@ async def view_products(
 
 
 @app.get("/purchase/{purchase_id}", response_class=HTMLResponse)
-async def purchase_detail(purchase_id: int, request: Request, db: Session = Depends(get_db)):
+def purchase_detail(purchase_id: int, request: Request, db: Session = Depends(get_db)):
     purchase = db.query(Purchase).filter(Purchase.id == purchase_id).first()
     if not purchase:
         return HTMLResponse("Purchase not found", status_code=404)
 
     items = purchase.items
-    line_items = []
-    subtotal_before_tax = 0.0
-    total_tax = 0.0
-    for i in items:
-        unit = i.product.price_per_unit
-        qty = i.quantity
-        tax_pct = i.product.tax_percentage
-        line_sub = unit * qty
-        line_tax = line_sub * (tax_pct / 100.0)
-        subtotal_before_tax += line_sub
-        total_tax += line_tax
-        line_items.append({
-            "product_name": i.product.name,
-            "product_code": i.product.product_id,
-            "quantity": qty,
-            "unit_price": unit,
-            "tax_percent": tax_pct,
-            "subtotal": round(line_sub, 2),
-            "tax_amount": round(line_tax, 2),
-            "line_total": round(line_sub + line_tax, 2),
-        })
+    line_items, subtotal_before_tax, total_tax = build_line_items(items)
 
     return templates.TemplateResponse("purchase_detail.html", {
         "request": request,
         "purchase": purchase,
         "items": items,
         "line_items": line_items,
-        "subtotal_before_tax": round(subtotal_before_tax, 2),
-        "total_tax": round(total_tax, 2),
+        "subtotal_before_tax": subtotal_before_tax,
+        "total_tax": total_tax,
     })
 
 ############# Application Run Command #############
@@ -0,0 +1,71 @@
+# benchmarks/pricing.py
+"""
+Bill-totals microbenchmark: the old per-line float loop vs pricing.price_lines()
+(pure Python and, when installed, NumPy). Also reports how far the float net
+total is from the exact one, which sums per-line amounts rounded to the paisa.
+
+    python -m benchmarks.pricing
+    python -m benchmarks.pricing --sizes 100 10000 1000000
+"""
+import time
+import random
+import argparse
+from typing import List, Optional
+
+import pricing
+
+
+def _float_loop(lines):
+    # The loop generate_bill / purchase_detail / the mailer used before pricing.py
+    subtotal = total_tax = 0.0
+    for unit, qty, tax_pct in lines:
+        amount = unit * qty
+        tax_amount = amount * (tax_pct / 100.0)
+        subtotal += amount
+        total_tax += tax_amount
+    return round(subtotal, 2), round(total_tax, 2), round(subtotal + total_tax, 2)
+
+
+def _lines(n: int, seed: int = 7):
+    rng = random.Random(seed)
+    catalog = [(round(rng.uniform(0.5, 5000), 2), rng.choice([0.0, 5.0, 12.0, 18.0, 28.0, 12.5]))
+               for _ in range(500)]
+    return [(price, rng.randrange(1, 1000), tax) for price, tax in (rng.choice(catalog) for _ in range(n))]
+
+
+def _best_of(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Bill-totals microbenchmark.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 1_000, 10_000, 100_000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    has_numpy = pricing._numpy() is not None
+    print(f"numpy: {'available' if has_numpy else 'not installed'}")
+    for n in args.sizes:
+        lines = _lines(n)
+        t_float = _best_of(lambda: _float_loop(lines), args.repeat)
+        # price_lines() split into columns first; time the engines on the same input
+        prices, quantities, rates = (list(c) for c in zip(*lines))
+        t_python = _best_of(lambda: pricing._price_python(prices, quantities, rates), args.repeat)
+        row = f"{n:>9} lines  float loop {t_float * 1e3:9.2f} ms  exact python {t_python * 1e3:9.2f} ms"
+        if has_numpy:
+            t_numpy = _best_of(lambda: pricing._price_numpy(prices, quantities, rates), args.repeat)
+            row += f"  exact numpy {t_numpy * 1e3:9.2f} ms"
+
+        net_float = _float_loop(lines)[2]
+        net_exact = pricing.rupees(pricing.price_lines(lines).net)
+        row += f"  float net off by {net_float - net_exact:+.2f}"
+        print(row)
+
+
+if __name__ == "__main__":
+    main()
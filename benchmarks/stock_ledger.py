@@ -0,0 +1,142 @@
+# benchmarks/stock_ledger.py
+"""
+Checkout throughput on one hot SKU, with the stock ledger off and on.
+
+Starts the real app under uvicorn (one process, SMTP replaced by a no-op) on a
+throw-away database and sends concurrent POST /generate_bill requests, each
+buying 1 x "Pen". Without the ledger the route decrements the product row;
+with it the stock is reserved in memory and flushed in batches. After the
+server has shut down, the final stock is checked against the number of
+successful bills, which also shows lost updates in the row-level version.
+
+    python -m benchmarks.stock_ledger
+    python -m benchmarks.stock_ledger --threads 16 --checkouts 100
+"""
+import os
+import sys
+import time
+import signal
+import socket
+import argparse
+import tempfile
+import subprocess
+import threading
+from pathlib import Path
+from typing import List, Optional
+
+import httpx
+
+ROOT = Path(__file__).resolve().parents[1]
+STARTING_STOCK = 10_000_000
+
+# Serve app.py without ever talking to an SMTP server
+_SERVER = """
+import sys, uvicorn, mail_notification
+mail_notification._send_smtp_email = lambda *a, **kw: None
+uvicorn.run("app:app", host="127.0.0.1", port=int(sys.argv[1]), log_level="warning")
+"""
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _seed(db_url: str):
+    from sqlalchemy import create_engine, text
+    from migrations import migrate
+    engine = create_engine(db_url)
+    migrate(engine)
+    with engine.begin() as conn:
+        conn.execute(text(
+            "INSERT INTO products (product_id, name, available_stock, price_per_unit, tax_percentage) "
+            "VALUES ('P1001', 'Pen', :stock, 10.0, 5.0)"), {"stock": STARTING_STOCK})
+    return engine
+
+
+def _wait_until_up(url: str, server: subprocess.Popen):
+    for _ in range(200):
+        if server.poll() is not None:
+            raise RuntimeError("server exited during startup")
+        try:
+            httpx.get(f"{url}/billing", timeout=1.0)
+            return
+        except httpx.TransportError:
+            time.sleep(0.05)
+    raise RuntimeError("server did not start")
+
+
+def _run(use_ledger: bool, threads: int, checkouts: int, flush_interval: float) -> None:
+    from sqlalchemy import text
+    with tempfile.TemporaryDirectory() as tmp:
+        db_url = f"sqlite:///{Path(tmp) / 'bench.db'}"
+        engine = _seed(db_url)
+        port = _free_port()
+        env = {
+            **os.environ,
+            "BILLING_DATABASE_URL": db_url,
+            "BILLING_STOCK_LEDGER": "1" if use_ledger else "",
+            "BILLING_LEDGER_FLUSH_SECONDS": str(flush_interval),
+            # Journal next to the throw-away database, not in the repo
+            "BILLING_LEDGER_JOURNAL": str(Path(tmp) / "stock_ledger.journal"),
+            "PYTHONPATH": str(ROOT),
+        }
+        server = subprocess.Popen([sys.executable, "-c", _SERVER, str(port)], cwd=tmp, env=env,
+                                  stdout=subprocess.DEVNULL)
+        url = f"http://127.0.0.1:{port}"
+        try:
+            _wait_until_up(url, server)
+            done = [0] * threads
+            failed = [0] * threads
+            form = {"customer_email": "bench@example.com", "paid_amount": "20",
+                    "product_id_1": "P1001", "quantity_1": "1"}
+
+            def worker(n):
+                with httpx.Client(base_url=url, timeout=60.0) as client:
+                    for _ in range(checkouts):
+                        try:
+                            ok = client.post("/generate_bill", data=form).status_code == 200
+                        except httpx.TransportError:  # e.g. timed out waiting on a database lock
+                            ok = False
+                        if ok:
+                            done[n] += 1
+                        else:
+                            failed[n] += 1
+
+            workers = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+            start = time.perf_counter()
+            for w in workers:
+                w.start()
+            for w in workers:
+                w.join()
+            elapsed = time.perf_counter() - start
+        finally:
+            server.send_signal(signal.SIGINT)  # graceful: the ledger flushes on shutdown
+            server.wait(timeout=60)
+
+        sold = sum(done)
+        with engine.connect() as conn:
+            stock = conn.execute(text("SELECT available_stock FROM products WHERE product_id = 'P1001'")).scalar()
+            bills = conn.execute(text("SELECT count(*) FROM purchases")).scalar()
+        engine.dispose()
+        lost = stock - (STARTING_STOCK - sold)
+        label = "ledger on " if use_ledger else "ledger off"
+        print(f"{label}: {sold} bills in {elapsed:.2f}s = {sold / elapsed:,.0f}/s "
+              f"({sum(failed)} failed, {bills} saved), final stock {stock} (lost updates: {lost})")
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Hot-SKU checkout benchmark against the app.")
+    parser.add_argument("--threads", type=int, default=8, help="concurrent clients")
+    parser.add_argument("--checkouts", type=int, default=100, help="per client")
+    parser.add_argument("--flush-interval", type=float, default=0.5)
+    parser.add_argument("--mode", choices=["off", "on", "both"], default="both")
+    args = parser.parse_args(argv)
+
+    for mode in (("off", "on") if args.mode == "both" else (args.mode,)):
+        _run(mode == "on", args.threads, args.checkouts, args.flush_interval)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,12 @@
+import os
 from pathlib import Path
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker, declarative_base
 
 BASE_DIR = Path(__file__).parent
 DB_PATH = BASE_DIR / "billing.db"
-SQLALCHEMY_DATABASE_URL = f"sqlite:///{DB_PATH}"
+# BILLING_DATABASE_URL points the app at another SQLite file (e.g. for checks)
+SQLALCHEMY_DATABASE_URL = os.getenv("BILLING_DATABASE_URL", f"sqlite:///{DB_PATH}")
 
 DB_PATH.parent.mkdir(parents=True, exist_ok=True)
 
@@ -26,4 +28,6 @@ def get_db():
         db.close()
 
 def init_db():
-    Base.metadata.create_all(bind=engine)
+    # Creates tables and applies any pending schema migrations
+    from migrations import migrate
+    migrate(engine)
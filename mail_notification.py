@@ -6,6 +6,7 @@ from email.message import EmailMessage
 from sqlalchemy.orm import Session
 from database import SessionLocal
 from models import Purchase
+from pricing import build_line_items
 
 # ---- Config Email ----
 SMTP_HOST="smtp.gmail.com"
@@ -15,29 +16,7 @@ SMTP_FROM="yourmail@gmail.com" # Update this with your actual email
 USE_SSL="true"
 
 def _build_line_items(purchase):
-    items = purchase.items
-    line_items = []
-    subtotal_before_tax = 0.0
-    total_tax = 0.0
-    for i in items:
-        unit = i.product.price_per_unit
-        qty = i.quantity
-        tax_pct = i.product.tax_percentage
-        line_sub = unit * qty
-        line_tax = line_sub * (tax_pct / 100.0)
-        subtotal_before_tax += line_sub
-        total_tax += line_tax
-        line_items.append({
-            "product_name": i.product.name,
-            "product_code": i.product.product_id,
-            "quantity": qty,
-            "unit_price": unit,
-            "tax_percent": tax_pct,
-            "subtotal": round(line_sub, 2),
-            "tax_amount": round(line_tax, 2),
-            "line_total": round(line_sub + line_tax, 2),
-        })
-    return line_items, round(subtotal_before_tax, 2), round(total_tax, 2)
+    return build_line_items(purchase.items)
 
 def _render_invoice_html(purchase, line_items, subtotal_before_tax, total_tax):
     net = subtotal_before_tax + total_tax
@@ -0,0 +1,72 @@
+# migrations.py
+"""
+Schema versioning for the SQLite database.
+
+The applied version is stored in `PRAGMA user_version`. Each entry in
+MIGRATIONS upgrades the schema by one version; `migrate()` runs the pending
+ones in a single transaction. Steps must be idempotent, because databases
+created before versioning existed start at version 0 with tables in place.
+
+    python migrations.py        # upgrade billing.db to the latest version
+"""
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.schema import CreateIndex
+from database import Base, engine
+import models  # registers tables on Base.metadata
+from purchase_search import create_search_index, rebuild_search_index
+
+
+def _create_tables(conn: Connection):
+    Base.metadata.create_all(bind=conn)
+
+
+def _add_hot_query_indexes(conn: Connection):
+    # create_all skips tables that already exist, including their indexes
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            conn.execute(CreateIndex(index, if_not_exists=True))
+
+
+def _add_purchase_search(conn: Connection):
+    create_search_index(conn)
+    rebuild_search_index(conn)
+
+
+def _add_stock_ledger_state(conn: Connection):
+    models.StockLedgerState.__table__.create(bind=conn, checkfirst=True)
+    conn.execute(text("INSERT OR IGNORE INTO stock_ledger_state (id, flushed_seq) VALUES (1, 0)"))
+
+
+MIGRATIONS = [
+    _create_tables,          # 1: base tables
+    _add_hot_query_indexes,  # 2: purchase_items / purchases / products indexes
+    _add_purchase_search,    # 3: FTS5 purchase search index
+    _add_stock_ledger_state, # 4: write-behind stock ledger checkpoint
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def get_schema_version(conn: Connection) -> int:
+    return conn.exec_driver_sql("PRAGMA user_version").scalar() or 0
+
+
+def migrate(bind: Engine = engine) -> int:
+    """Apply pending migrations; returns the resulting schema version."""
+    # Cheap read-only check first, so an up-to-date database costs one PRAGMA
+    with bind.connect() as conn:
+        version = get_schema_version(conn)
+    if version >= SCHEMA_VERSION:
+        return version
+
+    with bind.begin() as conn:
+        version = get_schema_version(conn)
+        for number, step in enumerate(MIGRATIONS[version:], start=version + 1):
+            step(conn)
+            conn.exec_driver_sql(f"PRAGMA user_version = {number}")
+            print(f"[DB] Applied migration {number}: {step.__name__}")
+        return max(version, SCHEMA_VERSION)
+
+
+if __name__ == "__main__":
+    print(f"[DB] Schema version {migrate()}")
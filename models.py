@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, ForeignKey, DateTime
+from sqlalchemy import Column, Integer, String, Float, ForeignKey, DateTime, Index, func
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from database import Base
@@ -7,7 +7,7 @@ class Product(Base):
     __tablename__ = "products"
     id = Column(Integer, primary_key=True)
     product_id = Column(String, unique=True, index=True, nullable=False)
-    name = Column(String, nullable=False)
+    name = Column(String, nullable=False, index=True)
     available_stock = Column(Integer, default=0)
     price_per_unit = Column(Float, nullable=False)
     tax_percentage = Column(Float, default=0.0)
@@ -19,7 +19,7 @@ class Purchase(Base):
     __tablename__ = "purchases"
     id = Column(Integer, primary_key=True)
     customer_email = Column(String, index=True, nullable=False)
-    purchase_time = Column(DateTime, default=datetime.utcnow)
+    purchase_time = Column(DateTime, default=datetime.utcnow, index=True)
     paid_amount = Column(Float, nullable=False)
     total_amount = Column(Float, nullable=False)
     balance = Column(Float, nullable=False)
@@ -27,6 +27,11 @@ class Purchase(Base):
 
 class PurchaseItem(Base):
     __tablename__ = "purchase_items"
+    __table_args__ = (
+        # items of a purchase / purchases containing a product
+        Index("ix_purchase_items_purchase_product", "purchase_id", "product_id"),
+        Index("ix_purchase_items_product_purchase", "product_id", "purchase_id"),
+    )
     id = Column(Integer, primary_key=True)
     purchase_id = Column(Integer, ForeignKey("purchases.id"))
     product_id = Column(Integer, ForeignKey("products.id"))
@@ -34,7 +39,21 @@ class PurchaseItem(Base):
     purchase = relationship("Purchase", back_populates="items")
     product = relationship("Product")
 
+# Drill-downs filter on the normalized product name / customer email
+Index("ix_products_name_norm", func.lower(func.trim(Product.name)))
+Index(
+    "ix_purchases_customer_norm_time",
+    func.lower(func.trim(Purchase.customer_email)),
+    Purchase.purchase_time,
+)
+
 class Denomination(Base):
     __tablename__ = "denominations"
     id = Column(Integer, primary_key=True)
     value = Column(Integer, unique=True)
+
+class StockLedgerState(Base):
+    # Single row: last stock-ledger journal entry applied to products
+    __tablename__ = "stock_ledger_state"
+    id = Column(Integer, primary_key=True)
+    flushed_seq = Column(Integer, nullable=False, default=0)
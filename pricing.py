@@ -0,0 +1,123 @@
+# pricing.py
+"""
+Shared bill arithmetic, exact to the paisa.
+
+Every price / tax calculation (billing, purchase detail, product revenue,
+invoice email) goes through `price_lines()`, which prices a whole batch of
+lines in one call using integer paise:
+
+    amount = unit price (paise) * quantity
+    tax    = amount * tax rate, rounded half-up to the paisa, per line
+    total  = amount + tax
+
+Bill totals are the sums of the rounded lines, so an invoice always adds up.
+Prices and tax rates are converted from the stored floats through Decimal,
+once per distinct value. Batches of NUMPY_MIN_LINES lines or more use NumPy
+when it is installed; both paths give identical results. NumPy is imported on
+the first such batch, so it does not slow down app start-up.
+"""
+from decimal import Decimal, ROUND_HALF_UP
+from typing import Dict, Iterable, List, NamedTuple, Sequence, Tuple
+
+NUMPY_MIN_LINES = 10_000
+
+_np = None  # numpy module once imported, False if it is not installed
+
+# (unit price in rupees, quantity, tax percentage)
+Line = Tuple[float, int, float]
+
+
+class PricedLines(NamedTuple):
+    amount: List[int]      # per line, paise
+    tax: List[int]         # per line, paise
+    total: List[int]       # per line, paise
+    subtotal: int          # sum of amount
+    total_tax: int         # sum of tax
+    net: int               # subtotal + total_tax
+
+
+def to_paise(rupees) -> int:
+    return int((Decimal(str(rupees or 0)) * 100).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+def to_basis_points(percent) -> int:
+    """Tax percentage in hundredths of a percent (12.5% -> 1250)."""
+    return int((Decimal(str(percent or 0)) * 100).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+def rupees(paise: int) -> float:
+    """Paise -> rupees for display / float columns."""
+    return paise / 100
+
+
+def _numpy():
+    """NumPy if installed (optional, only used for very large batches), else None."""
+    global _np
+    if _np is None:
+        try:
+            import numpy
+            _np = numpy
+        except ImportError:
+            _np = False
+    return _np or None
+
+
+def _converted(values: Iterable, convert) -> Dict:
+    return {v: convert(v) for v in set(values)}
+
+
+def _price_python(prices, quantities, rates) -> PricedLines:
+    paise = _converted(prices, to_paise)
+    bps = _converted(rates, to_basis_points)
+    amount = [paise[p] * q for p, q in zip(prices, quantities)]
+    # half-up to the paisa; amounts are never negative
+    tax = [(a * bps[r] + 5000) // 10000 for a, r in zip(amount, rates)]
+    total = [a + t for a, t in zip(amount, tax)]
+    subtotal, total_tax = sum(amount), sum(tax)
+    return PricedLines(amount, tax, total, subtotal, total_tax, subtotal + total_tax)
+
+
+def _price_numpy(prices, quantities, rates) -> PricedLines:
+    # Convert each distinct price / rate through Decimal, then map back
+    np = _numpy()
+    n = len(prices)
+    uniq_prices, price_idx = np.unique(np.fromiter(prices, np.float64, n), return_inverse=True)
+    uniq_rates, rate_idx = np.unique(np.fromiter(rates, np.float64, n), return_inverse=True)
+    paise = np.array([to_paise(p) for p in uniq_prices.tolist()], dtype=np.int64)[price_idx]
+    bps = np.array([to_basis_points(r) for r in uniq_rates.tolist()], dtype=np.int64)[rate_idx]
+
+    amount = paise * np.fromiter(quantities, np.int64, n)
+    tax = (amount * bps + 5000) // 10000
+    total = amount + tax
+    subtotal, total_tax = int(amount.sum()), int(tax.sum())
+    return PricedLines(amount.tolist(), tax.tolist(), total.tolist(), subtotal, total_tax, subtotal + total_tax)
+
+
+def price_lines(lines: Sequence[Line]) -> PricedLines:
+    """Price a batch of (unit_price, quantity, tax_percent) lines."""
+    prices = [p or 0.0 for p, _, _ in lines]
+    quantities = [int(q or 0) for _, q, _ in lines]
+    rates = [r or 0.0 for _, _, r in lines]
+    if len(lines) >= NUMPY_MIN_LINES and _numpy() is not None:
+        return _price_numpy(prices, quantities, rates)
+    return _price_python(prices, quantities, rates)
+
+
+def build_line_items(items) -> Tuple[List[Dict], float, float]:
+    """Invoice rows for PurchaseItem-like objects (item.quantity, item.product.*),
+    plus subtotal before tax and total tax in rupees."""
+    items = list(items)
+    priced = price_lines([
+        (i.product.price_per_unit, i.quantity, i.product.tax_percentage) for i in items
+    ])
+    line_items = [{
+        "product_name": i.product.name,
+        "product_code": i.product.product_id,
+        "quantity": i.quantity,
+        "unit_price": i.product.price_per_unit,
+        "tax_percent": i.product.tax_percentage,
+        "subtotal": rupees(a),
+        "tax_amount": rupees(t),
+        "line_total": rupees(total),
+    } for i, a, t, total in zip(items, priced.amount, priced.tax, priced.total)]
+    return line_items, rupees(priced.subtotal), rupees(priced.total_tax)
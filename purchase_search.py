@@ -0,0 +1,195 @@
+# purchase_search.py
+"""
+Full-text search over purchases (SQLite FTS5).
+
+One `purchase_search` row per purchase (rowid = purchase id) holding the
+invoice number, customer email and the codes/names of the products on its
+lines. The trigram tokenizer lets partial emails / product names match.
+
+- generate_bill indexes each new purchase in the same transaction
+- product renames/deletes re-index the purchases that contain the product
+- deleting a purchase removes its row through a trigger
+
+    python purchase_search.py rebuild    # re-create the index from scratch
+"""
+import sys
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import DateTime, text
+
+CREATE_STATEMENTS = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS purchase_search USING fts5(
+        invoice, customer_email, products, tokenize = 'trigram'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS purchase_search_purchase_deleted
+    AFTER DELETE ON purchases BEGIN
+        DELETE FROM purchase_search WHERE rowid = OLD.id;
+    END
+    """,
+]
+
+# Search document for every purchase matched by {where}
+_INDEX_SELECT = """
+    SELECT p.id, p.id, p.customer_email,
+           coalesce((SELECT group_concat(pr.product_id || ' ' || pr.name, ' ')
+                     FROM purchase_items i JOIN products pr ON pr.id = i.product_id
+                     WHERE i.purchase_id = p.id), '')
+    FROM purchases p
+    {where}
+"""
+_INSERT = "INSERT INTO purchase_search (rowid, invoice, customer_email, products)"
+
+_RESULT_SELECT = """
+    SELECT p.id, p.customer_email, p.purchase_time, p.total_amount,
+           p.paid_amount, p.balance, coalesce(s.products, '') AS products
+"""
+# Column weights for bm25(): invoice, customer_email, products
+_RANK = "bm25(purchase_search, 10.0, 5.0, 1.0)"
+# The trigram tokenizer cannot match shorter terms
+MIN_TERM_LENGTH = 3
+# Matches counted and ranked per search; more are reported as "1000+"
+MAX_MATCHES = 1000
+# Index matches checked against terms shorter than MIN_TERM_LENGTH
+MAX_SCANNED = 10 * MAX_MATCHES
+
+
+def create_search_index(conn):
+    for stmt in CREATE_STATEMENTS:
+        conn.execute(text(stmt))
+
+
+def index_purchase(db, purchase_id: int):
+    """(Re-)index one purchase; run after its items are flushed."""
+    db.execute(text("DELETE FROM purchase_search WHERE rowid = :id"), {"id": purchase_id})
+    db.execute(
+        text(f"{_INSERT} {_INDEX_SELECT.format(where='WHERE p.id = :id')}"),
+        {"id": purchase_id},
+    )
+
+
+def reindex_product(db, product_pk: int):
+    """Re-index purchases that contain a product, e.g. after it was renamed."""
+    ids = "SELECT purchase_id FROM purchase_items WHERE product_id = :pk"
+    db.execute(text(f"DELETE FROM purchase_search WHERE rowid IN ({ids})"), {"pk": product_pk})
+    db.execute(
+        text(f"{_INSERT} {_INDEX_SELECT.format(where=f'WHERE p.id IN ({ids})')}"),
+        {"pk": product_pk},
+    )
+
+
+def rebuild_search_index(conn):
+    conn.execute(text("DELETE FROM purchase_search"))
+    conn.execute(text(f"{_INSERT} {_INDEX_SELECT.format(where='')}"))
+    conn.execute(text("INSERT INTO purchase_search (purchase_search) VALUES ('optimize')"))
+
+
+def _split_terms(query: str) -> Tuple[List[str], List[str]]:
+    """User input -> (terms the index can match, shorter terms). A leading
+    "#" (invoice #123) is dropped, since the index holds the bare number."""
+    terms = [t for t in (t.lstrip("#") for t in query.split()) if t]
+    return ([t for t in terms if len(t) >= MIN_TERM_LENGTH],
+            [t for t in terms if len(t) < MIN_TERM_LENGTH])
+
+
+def _match_expression(terms: List[str]) -> Optional[str]:
+    """FTS5 query: every term must match, quoted so that operators /
+    punctuation in emails are taken literally."""
+    if not terms:
+        return None
+    return " AND ".join('"' + t.replace('"', '""') + '"' for t in terms)
+
+
+def _short_term_filter(terms: List[str], params: Dict) -> str:
+    """Terms too short for the index are checked as substrings of the rows
+    matched by the others, so "Pen 17" still needs the "17" somewhere."""
+    clauses = []
+    for n, term in enumerate(terms):
+        params[f"short_{n}"] = term.lower()
+        clauses.append(f" AND instr(lower(s.invoice || ' ' || s.customer_email || ' ' || s.products), :short_{n}) > 0")
+    return "".join(clauses)
+
+
+def _newest_matches(rank: str) -> str:
+    """The newest MAX_SCANNED rows matching the indexed terms: FTS5 walks
+    rowids backwards and stops at the limit."""
+    return f"""
+        SELECT s.rowid AS id, {rank} s.invoice, s.customer_email, s.products
+        FROM purchase_search s
+        WHERE purchase_search MATCH :match
+        ORDER BY s.rowid DESC
+        LIMIT :scan
+    """
+
+
+def search_purchases(db, query: str, page: int = 1, per_page: int = 25) -> Tuple[List[Dict], int]:
+    """Ranked page of purchases matching `query` plus the match count, capped
+    at MAX_MATCHES + 1 (shown as "1000+"). Only the newest MAX_MATCHES matches
+    (out of at most MAX_SCANNED index matches) are counted and ranked, so a
+    term found in every purchase costs the same as a rare one. An exact
+    invoice number ("123" or "#123") is always listed first."""
+    query = (query or "").strip()
+    invoice = query.lstrip("#")
+    exact_id = int(invoice) if invoice.isdigit() else None
+    terms, short_terms = _split_terms(query)
+    match = _match_expression(terms)
+    offset = (max(page, 1) - 1) * per_page
+
+    if match is None:
+        # Too short for the trigram index: only an exact invoice lookup is possible
+        if exact_id is None:
+            return [], 0
+        rows = db.execute(
+            text(f"""
+                {_RESULT_SELECT}
+                FROM purchases p LEFT JOIN purchase_search s ON s.rowid = p.id
+                WHERE p.id = :id
+            """).columns(purchase_time=DateTime),
+            {"id": exact_id},
+        ).mappings().all()
+        return ([dict(r) for r in rows] if page <= 1 else []), len(rows)
+
+    params = {"match": match, "exact_id": exact_id, "scan": MAX_SCANNED}
+    short = _short_term_filter(short_terms, params)
+    total = db.execute(
+        text(f"SELECT count(*) FROM (SELECT 1 FROM ({_newest_matches('')}) s WHERE 1{short} LIMIT :cap)"),
+        {**params, "cap": MAX_MATCHES + 1},
+    ).scalar()
+    # Candidates: the newest MAX_MATCHES rows plus the exact invoice, wherever it is
+    exact = f"""
+            UNION
+            SELECT s.rowid, {_RANK}, s.products
+            FROM purchase_search s
+            WHERE purchase_search MATCH :match{short} AND s.rowid = :exact_id""" if exact_id is not None else ""
+    rows = db.execute(text(f"""
+        WITH candidates AS (
+            SELECT * FROM (
+                SELECT id, rank, products
+                FROM ({_newest_matches(f'{_RANK} AS rank,')}) s
+                WHERE 1{short}
+                LIMIT :cap
+            ){exact}
+        )
+        SELECT p.id, p.customer_email, p.purchase_time, p.total_amount,
+               p.paid_amount, p.balance, coalesce(c.products, '') AS products
+        FROM candidates c
+        JOIN purchases p ON p.id = c.id
+        ORDER BY c.id = :exact_id DESC, c.rank
+        LIMIT :limit OFFSET :offset
+    """).columns(purchase_time=DateTime),
+        {**params, "cap": MAX_MATCHES, "limit": per_page, "offset": offset},
+    ).mappings().all()
+    return [dict(r) for r in rows], total
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["rebuild"]:
+        sys.exit("usage: python purchase_search.py rebuild")
+    from database import engine
+    from migrations import migrate
+    migrate(engine)
+    with engine.begin() as conn:
+        rebuild_search_index(conn)
+        count = conn.execute(text("SELECT count(*) FROM purchase_search")).scalar()
+    print(f"[SEARCH] Indexed {count} purchases")
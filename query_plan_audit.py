@@ -0,0 +1,304 @@
+# query_plan_audit.py
+"""
+Query-plan regression check for the hot queries.
+
+Builds a throw-away SQLite database with synthetic data, exercises every route
+in app.py plus the mail / resend paths, captures each SQL statement they issue
+(for INSERT ... SELECT, its SELECT) and runs `EXPLAIN QUERY PLAN` on it. The check fails (exit code 1) when a query
+
+  - scans a table (`SCAN ...`) that holds more than --threshold rows, or
+  - builds a temp B-tree (ORDER BY / GROUP BY / DISTINCT) while reading such
+    a table, whether by scan or by index search,
+
+unless ALLOWED_PLANS permits that scan or sort for the statement under that
+exact label (route including its query string), with a reason.
+tests/test_query_plans.py runs the same check under pytest, one case per
+captured query.
+
+    python query_plan_audit.py
+    python query_plan_audit.py --purchases 20000 --threshold 500 -v
+"""
+import os
+import re
+import sys
+import random
+import argparse
+import tempfile
+from pathlib import Path
+from datetime import datetime, timedelta
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+DEFAULT_THRESHOLD = 1000
+DEFAULT_SIZES = {"products": 2000, "purchases": 5000, "items_per_purchase": 3}
+
+
+
+class Allowance(NamedTuple):
+    reason: str
+    scan: Tuple[str, ...] = ()  # tables the statement may read in full
+    sort: bool = False          # may build temp B-trees over large tables
+
+
+# Statements that intentionally read a whole table or sort a large result,
+# keyed by (label, fragment of the statement). Each entry only permits what it
+# names, so losing an index behind an allowed statement is still reported.
+_CUSTOMER_COUNTS = "GROUP BY email ORDER BY count(purchases.id) DESC"
+_UNIQUE_CUSTOMERS = "count(distinct(lower(trim(purchases.customer_email))))"
+_ALL_PURCHASES = "FROM purchases ORDER BY purchases.purchase_time DESC"
+_PRODUCT_COUNTS = "GROUP BY lower(trim(products.name)) ORDER BY count(distinct"
+_CATALOGUE = "FROM products ORDER BY products.name ASC"
+ALLOWED_PLANS: Dict[Tuple[str, str], Allowance] = {
+    ("startup", "FROM products LIMIT ? OFFSET ?"): Allowance(
+        "seed check only asks whether any product exists; the scan stops at the first row",
+        scan=("products",)),
+    ("GET /purchases", _ALL_PURCHASES): Allowance(
+        "unpaginated dashboard lists every purchase (in index order)", scan=("purchases",)),
+    ("GET /purchases", _UNIQUE_CUSTOMERS): Allowance(
+        "unique-customer total counts over every purchase", scan=("purchases",)),
+    ("GET /purchases", _CUSTOMER_COUNTS): Allowance(
+        "orders per customer aggregate every purchase, then sort the groups",
+        scan=("purchases",), sort=True),
+    ("GET /purchases?customer=", _ALL_PURCHASES): Allowance(
+        "the filtered page still shows the full purchases table above the customer's",
+        scan=("purchases",)),
+    ("GET /purchases?customer=", _UNIQUE_CUSTOMERS): Allowance(
+        "unique-customer total is shown above the filtered table too", scan=("purchases",)),
+    ("GET /purchases?customer=", _CUSTOMER_COUNTS): Allowance(
+        "customer sidebar is shown above the filtered table too", scan=("purchases",), sort=True),
+    ("GET /customers", _CUSTOMER_COUNTS): Allowance(
+        "orders per customer aggregate every purchase, then sort the groups",
+        scan=("purchases",), sort=True),
+    ("GET /customers?customer=", _CUSTOMER_COUNTS): Allowance(
+        "customer list is shown next to the drill-down", scan=("purchases",), sort=True),
+    ("GET /products", _PRODUCT_COUNTS): Allowance(
+        "order/quantity counts per product aggregate every line",
+        scan=("purchase_items",), sort=True),
+    ("GET /products?product=", _PRODUCT_COUNTS): Allowance(
+        "product list is shown next to the drill-down", scan=("purchase_items",), sort=True),
+    ("GET /products?product=", "WHERE lower(trim(products.name)) = ? ORDER BY purchases.purchase_time DESC"): Allowance(
+        "rows come from the product-name and product indexes; only that product's orders are sorted by time",
+        sort=True),
+    ("GET /purchases/search", "bm25(purchase_search"): Allowance(
+        "relevance ranking sorts at most MAX_MATCHES candidate rows", sort=True),
+    ("GET /billing", _CATALOGUE): Allowance(
+        "product picker lists the whole catalogue", scan=("products",)),
+    ("GET /admin/products", _CATALOGUE): Allowance(
+        "admin product list shows the whole catalogue", scan=("products",)),
+    ("POST /admin/products/new", _CATALOGUE): Allowance(
+        "redirect target renders the admin product list", scan=("products",)),
+    ("POST /admin/products/{id}/edit", _CATALOGUE): Allowance(
+        "redirect target renders the admin product list", scan=("products",)),
+    ("POST /admin/products/{id}/delete", _CATALOGUE): Allowance(
+        "redirect target renders the admin product list", scan=("products",)),
+}
+
+_NON_QUERY = ("PRAGMA", "BEGIN", "COMMIT", "ROLLBACK", "SAVEPOINT", "RELEASE", "CREATE")
+# INSERT ... SELECT: the SELECT part is what reads tables; INSERT ... VALUES reads none
+_INSERT_SELECT_RE = re.compile(r"^\s*INSERT\b[^()]*?(\([^()]*\))?\s*(?=(SELECT|WITH)\b)", re.IGNORECASE)
+_READ_RE = re.compile(r"^(SCAN|SEARCH) (\w+)")
+_ALIAS_RE = re.compile(r"\b(\w+) AS (\w+)\b")
+
+# (label, statement, parameters) as issued by the app
+Captured = Tuple[str, str, object]
+
+
+def _seed(conn, n_products: int, n_purchases: int, items_per_purchase: int):
+    rng = random.Random(42)
+    conn.executemany(
+        "INSERT INTO products (id, product_id, name, available_stock, price_per_unit, tax_percentage) "
+        "VALUES (?, ?, ?, ?, ?, ?)",
+        [(i, f"P{1000 + i}", f"Product {i}", 10_000, round(rng.uniform(1, 500), 2), rng.choice([0, 5, 12, 18]))
+         for i in range(1, n_products + 1)],
+    )
+    start = datetime(2024, 1, 1)
+    conn.executemany(
+        "INSERT INTO purchases (id, customer_email, purchase_time, paid_amount, total_amount, balance) "
+        "VALUES (?, ?, ?, ?, ?, ?)",
+        [(i, f"customer{rng.randrange(n_purchases // 5 + 1)}@example.com",
+          (start + timedelta(minutes=i)).isoformat(sep=" "), 1000.0, 900.0, 100.0)
+         for i in range(1, n_purchases + 1)],
+    )
+    conn.executemany(
+        "INSERT INTO purchase_items (purchase_id, product_id, quantity) VALUES (?, ?, ?)",
+        [(p, rng.randrange(1, n_products + 1), rng.randrange(1, 5))
+         for p in range(1, n_purchases + 1) for _ in range(items_per_purchase)],
+    )
+    conn.executemany("INSERT INTO denominations (value) VALUES (?)",
+                     [(v,) for v in [2000, 500, 200, 100, 50, 20, 10, 5, 2, 1]])
+
+
+def _exercise(client, label_ref: List[str]):
+    """Hit every route; label_ref[0] tags the statements captured meanwhile."""
+    import mail_notification
+    import resend_invoices
+    from database import SessionLocal
+
+    def run(label, fn):
+        label_ref[0] = label
+        resp = fn()
+        if resp is not None and resp.status_code >= 500:
+            raise RuntimeError(f"{label} returned {resp.status_code}")
+
+    form = {"product_id": "P9999", "name": "Audit", "available_stock": "5",
+            "price_per_unit": "1", "tax_percentage": "0"}
+    run("GET /billing", lambda: client.get("/billing"))
+    run("GET /admin/products", lambda: client.get("/admin/products"))
+    run("POST /admin/products/new", lambda: client.post("/admin/products/new", data=form))
+    run("GET /admin/products/{id}/edit", lambda: client.get("/admin/products/1/edit"))
+    run("POST /admin/products/{id}/edit", lambda: client.post("/admin/products/1/edit", data={**form, "product_id": "P1001"}))
+    run("GET /admin/invoices/resend", lambda: client.get("/admin/invoices/resend"))
+    run("POST /generate_bill", lambda: client.post("/generate_bill", data={
+        "customer_email": "audit@example.com", "paid_amount": "100000",
+        "product_id_1": "P1002", "quantity_1": "1", "product_id_2": "P1003", "quantity_2": "2",
+    }))
+    run("GET /purchases", lambda: client.get("/purchases"))
+    run("GET /purchases?customer=", lambda: client.get("/purchases", params={"customer": "customer1@example.com"}))
+    run("GET /customers", lambda: client.get("/customers"))
+    run("GET /customers?customer=", lambda: client.get("/customers", params={"customer": "customer1@example.com"}))
+    run("GET /products", lambda: client.get("/products"))
+    run("GET /products?product=", lambda: client.get("/products", params={"product": "product 3"}))
+    run("GET /purchase/{id}", lambda: client.get("/purchase/7"))
+    run("GET /purchases/search", lambda: client.get("/purchases/search", params={"q": "customer12 P1003"}))
+    run("GET /purchases/search?q=#id", lambda: client.get("/purchases/search", params={"q": "#7"}))
+    run("send_invoice_email", lambda: mail_notification.send_invoice_email("audit@example.com", 7))
+
+    def _load(**kw):
+        db = SessionLocal()
+        try:
+            resend_invoices.load_purchases(db, **kw)
+        finally:
+            db.close()
+    run("resend by date", lambda: _load(start=datetime(2024, 1, 2), end=datetime(2024, 1, 3)))
+    run("resend by customer", lambda: _load(customer="customer1@example.com"))
+    run("POST /admin/products/{id}/delete", lambda: client.post("/admin/products/2/delete"))
+
+
+def allowance_for(label: str, statement: str) -> Optional[Allowance]:
+    flat = " ".join(statement.split())
+    for (allowed_label, fragment), allowance in ALLOWED_PLANS.items():
+        if allowed_label == label and fragment in flat:
+            return allowance
+    return None
+
+
+def check_plan(conn, label, statement, params, table_rows, threshold=DEFAULT_THRESHOLD):
+    """(problems, plan details) for one captured statement."""
+    aliases = {alias: table for table, alias in _ALIAS_RE.findall(statement)}
+    plan = conn.execute(f"EXPLAIN QUERY PLAN {statement}", params or ()).fetchall()
+    details = [row[3] for row in plan]
+    allowance = allowance_for(label, statement) or Allowance("")
+
+    problems = []
+    large_reads = []
+    for d in details:
+        m = _READ_RE.match(d)
+        if not m or "VIRTUAL TABLE" in d:  # FTS lookups are index-driven
+            continue
+        table = aliases.get(m.group(2), m.group(2))
+        if table_rows.get(table, 0) <= threshold:  # also skips subquery / CTE scans
+            continue
+        large_reads.append(table)
+        if m.group(1) == "SCAN" and table not in allowance.scan:
+            problems.append(f"full scan of {table} ({table_rows[table]} rows)")
+    if large_reads and not allowance.sort:
+        # A sort over rows read from a large table, however they were found
+        tables = ", ".join(sorted(set(large_reads)))
+        problems += [f"{d} over {tables}" for d in details if "TEMP B-TREE" in d]
+    return problems, details
+
+
+def table_sizes(conn) -> Dict[str, int]:
+    return {
+        name: conn.execute(f'SELECT count(*) FROM "{name}"').fetchone()[0]
+        for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'").fetchall()
+    }
+
+
+def collect(products: int = DEFAULT_SIZES["products"],
+            purchases: int = DEFAULT_SIZES["purchases"],
+            items_per_purchase: int = DEFAULT_SIZES["items_per_purchase"]) -> List[Captured]:
+    """Seed the configured (empty) database, drive the app and return every
+    distinct (label, statement, params) it issued. BILLING_DATABASE_URL must
+    point at a throw-away database before this is called."""
+    from sqlalchemy import event
+    from fastapi.testclient import TestClient
+    import mail_notification
+    from database import engine
+    import app as billing_app  # applies migrations on import
+
+    with engine.begin() as conn:
+        _seed(conn.connection, products, purchases, items_per_purchase)
+
+    captured: List[Captured] = []
+    seen = set()
+    label_ref = ["startup"]
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _capture(conn, cursor, statement, parameters, context, executemany):
+        if executemany or statement.lstrip().upper().startswith(_NON_QUERY):
+            return
+        if statement.lstrip().upper().startswith("INSERT"):
+            m = _INSERT_SELECT_RE.match(statement)
+            if not m:
+                return
+            statement = statement[m.end():]
+        if (label_ref[0], statement) not in seen:
+            seen.add((label_ref[0], statement))
+            captured.append((label_ref[0], statement, parameters))
+
+    # Never talk to a real SMTP server from the audit
+    send_smtp = mail_notification._send_smtp_email
+    mail_notification._send_smtp_email = lambda *a, **kw: None
+    try:
+        with TestClient(billing_app.app) as client:
+            _exercise(client, label_ref)
+    finally:
+        mail_notification._send_smtp_email = send_smtp
+        event.remove(engine, "before_cursor_execute", _capture)
+    return captured
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Fail on full scans / temp B-tree sorts in hot queries.")
+    parser.add_argument("--threshold", type=int, default=DEFAULT_THRESHOLD,
+                        help="max rows a table may have and still be scanned or sorted")
+    parser.add_argument("--products", type=int, default=DEFAULT_SIZES["products"])
+    parser.add_argument("--purchases", type=int, default=DEFAULT_SIZES["purchases"])
+    parser.add_argument("--items-per-purchase", type=int, default=DEFAULT_SIZES["items_per_purchase"])
+    parser.add_argument("-v", "--verbose", action="store_true", help="print every plan")
+    args = parser.parse_args(argv)
+
+    tmpdir = tempfile.TemporaryDirectory()
+    # Set before database.py is imported, so the engine binds to the audit database
+    os.environ["BILLING_DATABASE_URL"] = f"sqlite:///{Path(tmpdir.name) / 'audit.db'}"
+    captured = collect(args.products, args.purchases, args.items_per_purchase)
+
+    from database import engine
+    failures = 0
+    raw = engine.raw_connection()
+    try:
+        table_rows = table_sizes(raw)
+        for label, statement, params in captured:
+            problems, details = check_plan(raw, label, statement, params, table_rows, args.threshold)
+            if problems or args.verbose:
+                flat = " ".join(statement.split())
+                allowance = allowance_for(label, statement)
+                print(f"{'FAIL' if problems else 'ok  '} [{label}] {flat}")
+                for d in details:
+                    print(f"        {d}")
+                for p in problems:
+                    print(f"     -> {p}")
+                if allowance:
+                    print(f"     (allowed: {allowance.reason})")
+            failures += bool(problems)
+    finally:
+        raw.close()
+        engine.dispose()
+        tmpdir.cleanup()
+
+    print(f"[AUDIT] {len(captured)} distinct queries checked, {failures} failing (threshold {args.threshold} rows)")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
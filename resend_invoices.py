@@ -0,0 +1,284 @@
+# resend_invoices.py
+"""
+Bulk invoice regeneration and resend.
+
+Selects purchases by date range and/or customer, renders their invoices in a
+process pool and sends them through a bounded pool of SMTP workers. Every
+successfully sent purchase id is recorded in a state file, so a re-run with the
+same selection only retries what has not been sent yet. The state file is
+named after the selection (start / end / customer) and removed once a run
+finishes without failures, so it never affects a different or later job.
+
+Command line:
+    python resend_invoices.py --start 2025-01-01 --end 2025-01-02
+    python resend_invoices.py --customer someone@example.com --workers 4 --concurrency 8
+"""
+import os
+import json
+import hashlib
+import argparse
+import threading
+import multiprocessing
+from pathlib import Path
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from collections import deque
+from typing import Callable, Deque, Dict, Iterator, List, Optional, Set, Tuple
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from sqlalchemy import func
+from sqlalchemy.orm import Session, selectinload
+from database import SessionLocal
+from models import Purchase, PurchaseItem
+from mail_notification import _build_line_items, _render_invoice_html, _send_smtp_email
+
+BASE_DIR = Path(__file__).resolve().parent
+DEFAULT_STATE_DIR = BASE_DIR / "resend_state"
+
+# progress(done, total, purchase_id, error) -- error is None on success
+ProgressFn = Callable[[int, int, int, Optional[str]], None]
+
+
+def load_purchases(
+    db: Session,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    customer: Optional[str] = None,
+) -> List[Purchase]:
+    """Purchases in [start, end) for an optional customer, with items and products
+    loaded up-front (one query per table instead of one per purchase/line)."""
+    q = db.query(Purchase).options(
+        selectinload(Purchase.items).selectinload(PurchaseItem.product)
+    )
+    if start:
+        q = q.filter(Purchase.purchase_time >= start)
+    if end:
+        q = q.filter(Purchase.purchase_time < end)
+    if customer:
+        norm = customer.strip().lower()
+        q = q.filter(func.lower(func.trim(Purchase.customer_email)) == norm)
+    # (purchase_time, id) follows the time and customer indexes, so no sort step
+    return q.order_by(Purchase.purchase_time.asc(), Purchase.id.asc()).all()
+
+
+def _snapshot(purchase: Purchase) -> SimpleNamespace:
+    """Plain, picklable copy of a purchase with the attributes the invoice
+    helpers read, so rendering can run outside the DB session.
+    Raises ValueError if a line's product has since been deleted."""
+    for i in purchase.items:
+        if i.product is None:
+            raise ValueError(f"product #{i.product_id} on this invoice no longer exists")
+    return SimpleNamespace(
+        id=purchase.id,
+        customer_email=purchase.customer_email,
+        purchase_time=purchase.purchase_time,
+        paid_amount=purchase.paid_amount,
+        balance=purchase.balance,
+        items=[
+            SimpleNamespace(
+                quantity=i.quantity,
+                product=SimpleNamespace(
+                    name=i.product.name,
+                    product_id=i.product.product_id,
+                    price_per_unit=i.product.price_per_unit,
+                    tax_percentage=i.product.tax_percentage,
+                ),
+            )
+            for i in purchase.items
+        ],
+    )
+
+
+def _render_invoice(snapshot: SimpleNamespace) -> Tuple[int, str, str]:
+    """Process-pool worker: (purchase_id, customer_email, invoice_html)."""
+    line_items, sub, tax = _build_line_items(snapshot)
+    html = _render_invoice_html(snapshot, line_items, sub, tax)
+    return snapshot.id, snapshot.customer_email, html
+
+
+def render_invoices(
+    snapshots: List[SimpleNamespace], workers: int = 0, window: int = 8,
+) -> Iterator[Tuple[int, str, str]]:
+    """Render invoices, in a process pool when workers > 1, in order of input.
+    At most `window` renders are submitted ahead of the one being consumed, so
+    a slow consumer holds back rendering instead of piling up HTML."""
+    if workers <= 1 or len(snapshots) < 2:
+        for s in snapshots:
+            yield _render_invoice(s)
+        return
+    # spawn, not fork: the web app calls this from a process with live threads
+    # (request workers, the stock-ledger flusher) that a fork would copy mid-lock
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        in_flight: Deque[Future] = deque()
+        for s in snapshots:
+            if len(in_flight) >= max(1, window):
+                yield in_flight.popleft().result()
+            in_flight.append(pool.submit(_render_invoice, s))
+        while in_flight:
+            yield in_flight.popleft().result()
+
+
+def state_file_for(
+    start: Optional[datetime],
+    end: Optional[datetime],
+    customer: Optional[str],
+    state_dir: Path = DEFAULT_STATE_DIR,
+) -> Path:
+    """Resume log for one selection: an append-only list of sent purchase ids."""
+    key = json.dumps([
+        start.isoformat() if start else None,
+        end.isoformat() if end else None,
+        customer.strip().lower() if customer else None,
+    ])
+    return Path(state_dir) / f"{hashlib.sha1(key.encode()).hexdigest()[:16]}.log"
+
+
+def _load_state(path: Path) -> Set[int]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            # a torn last line (crash mid-write) is simply not counted as sent
+            return {int(line) for line in f if line.strip().isdigit() and line.endswith("\n")}
+    except FileNotFoundError:
+        return set()
+
+
+def _print_progress(done: int, total: int, purchase_id: int, error: Optional[str]):
+    if error:
+        print(f"[RESEND][ERROR] {done}/{total} purchase #{purchase_id}: {error}")
+    else:
+        print(f"[RESEND] {done}/{total} purchase #{purchase_id} sent")
+
+
+def resend_invoices(
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    customer: Optional[str] = None,
+    workers: int = 0,
+    concurrency: int = 4,
+    resume: bool = True,
+    state_dir: Path = DEFAULT_STATE_DIR,
+    progress: ProgressFn = _print_progress,
+) -> Dict:
+    """
+    Regenerate and resend invoices for the selected purchases.
+
+    - workers: processes used to render invoice HTML (0/1 = in-process)
+    - concurrency: max SMTP sends in flight at once
+    - resume: skip ids an interrupted run of the same selection already sent;
+      False sends everything again (progress is still recorded)
+    - state_dir: where the per-selection resume logs are kept
+    """
+    # One purchase that cannot be rendered must not stop the rest of the job
+    snapshots: List[SimpleNamespace] = []
+    unrenderable: Dict[int, str] = {}
+    db: Session = SessionLocal()
+    try:
+        for purchase in load_purchases(db, start, end, customer):
+            try:
+                snapshots.append(_snapshot(purchase))
+            except ValueError as e:
+                unrenderable[purchase.id] = str(e)
+    finally:
+        db.close()
+
+    state_file = state_file_for(start, end, customer, state_dir)
+    sent: Set[int] = _load_state(state_file) if resume else set()
+    pending = [s for s in snapshots if s.id not in sent]
+    summary = {
+        "selected": len(snapshots) + len(unrenderable),
+        "skipped": len(snapshots) - len(pending),
+        "sent": 0,
+        "failed": {},
+    }
+    total = len(pending) + len(unrenderable)
+    for purchase_id, error in unrenderable.items():
+        summary["failed"][purchase_id] = error
+        progress(len(summary["failed"]), total, purchase_id, error)
+    if not pending:
+        if not summary["failed"]:
+            state_file.unlink(missing_ok=True)
+        return summary
+
+    state_file.parent.mkdir(parents=True, exist_ok=True)
+    state_log = open(state_file, "a" if resume else "w", encoding="utf-8")
+    state_lock = threading.Lock()
+    lock = threading.Lock()
+    # At most 2 x concurrency invoices wait for an SMTP worker, and the render
+    # window below keeps at most as many renders ahead of them
+    backlog = max(1, concurrency) * 2
+    slots = threading.BoundedSemaphore(backlog)
+
+    def _send(purchase_id: int, to_email: str, html: str):
+        error = None
+        try:
+            _send_smtp_email(to_email, f"Invoice #{purchase_id}", html)
+        except Exception as e:
+            error = str(e) or e.__class__.__name__
+        finally:
+            slots.release()
+        if not error:
+            with state_lock:
+                state_log.write(f"{purchase_id}\n")
+                state_log.flush()
+        with lock:
+            if error:
+                summary["failed"][purchase_id] = error
+            else:
+                summary["sent"] += 1
+            done = summary["sent"] + len(summary["failed"])
+            progress(done, total, purchase_id, error)
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, concurrency)) as senders:
+            for purchase_id, to_email, html in render_invoices(pending, workers, window=backlog):
+                slots.acquire()
+                senders.submit(_send, purchase_id, to_email, html)
+    finally:
+        state_log.close()
+
+    if not summary["failed"]:
+        state_file.unlink(missing_ok=True)  # job complete: nothing left to resume
+    return summary
+
+
+def _parse_date(value: str) -> datetime:
+    return datetime.strptime(value, "%Y-%m-%d")
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Regenerate and resend invoice emails.")
+    parser.add_argument("--start", type=_parse_date, help="first day to include (YYYY-MM-DD)")
+    parser.add_argument("--end", type=_parse_date, help="last day to include (YYYY-MM-DD)")
+    parser.add_argument("--customer", help="only purchases for this customer email")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="processes used to render invoices")
+    parser.add_argument("--concurrency", type=int, default=4, help="parallel SMTP sends")
+    parser.add_argument("--state-dir", type=Path, default=DEFAULT_STATE_DIR,
+                        help="directory of per-selection resume logs")
+    parser.add_argument("--no-resume", action="store_true",
+                        help="send everything again, even if an earlier run of this selection got partway")
+    args = parser.parse_args(argv)
+
+    if not (args.start or args.end or args.customer):
+        parser.error("select purchases with --start/--end and/or --customer")
+
+    # --end is inclusive on the command line
+    end = args.end + timedelta(days=1) if args.end else None
+    summary = resend_invoices(
+        start=args.start,
+        end=end,
+        customer=args.customer,
+        workers=args.workers,
+        concurrency=args.concurrency,
+        resume=not args.no_resume,
+        state_dir=args.state_dir,
+    )
+    print(
+        f"[RESEND] selected={summary['selected']} skipped={summary['skipped']} "
+        f"sent={summary['sent']} failed={len(summary['failed'])}"
+    )
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,354 @@
+# stock_ledger.py
+"""
+Optional write-behind stock ledger.
+
+Keeps `products.available_stock` in memory so checkouts reserve stock without a
+row-level read-modify-write per line. Reservations are atomic across the SKUs
+of a bill (per-SKU locks taken in id order) and are tagged with the bill's
+purchase id. The journal records each step before it is acknowledged:
+
+    {"seq": 7, "reserve": 42, "deltas": {"3": -2}}   stock taken for purchase 42
+    {"seq": 8, "commit": 42}                         purchase 42 was saved
+    {"seq": 9, "release": 43}                        purchase 43 was not
+
+Only committed reservations are written back. A background thread
+periodically applies their aggregated deltas to `products` in one
+transaction, together with the journal sequence number they cover
+(`stock_ledger_state.flushed_seq`). On start-up the ledger reloads stock from
+the database and replays journal entries newer than that checkpoint. A
+reservation with neither marker (crash between reserving and the bill's
+commit) is settled by the database: kept if its purchase row exists, dropped
+otherwise. So a crash neither loses a sale nor leaks stock.
+
+The ledger owns the stock of its database for the life of the process and
+holds an exclusive lock on `<journal>.lock` to enforce that: run the app as a
+single process (no `uvicorn --workers N`) when it is enabled.
+
+Enable with BILLING_STOCK_LEDGER=1 (see app.py). Admin stock edits go through
+`StockLedger.editing()`, which flushes pending deltas for the SKU and re-reads
+the row once the edit is committed.
+"""
+import os
+import json
+import glob
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows: the single-process lock is not enforced
+    fcntl = None
+from pathlib import Path
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+from sqlalchemy import bindparam, text
+from sqlalchemy.engine import Engine
+
+BASE_DIR = Path(__file__).resolve().parent
+DEFAULT_JOURNAL = BASE_DIR / "stock_ledger.journal"
+
+# (product pk, available, requested) for the first SKU that cannot be reserved
+Shortage = Tuple[int, int, int]
+
+
+class StockLedger:
+    def __init__(
+        self,
+        engine: Engine,
+        journal_path: Path = DEFAULT_JOURNAL,
+        flush_interval: float = 1.0,
+        fsync: bool = False,
+    ):
+        self.engine = engine
+        self.journal_path = Path(journal_path)
+        self.flush_interval = flush_interval
+        self.fsync = fsync  # also survive power loss, at the cost of a disk sync per bill
+
+        self._stock: Dict[int, int] = {}
+        self._sku_locks: Dict[int, threading.Lock] = {}
+        self._locks_guard = threading.Lock()
+
+        # Guards the journal file, the sequence counter, the open reservations
+        # and the pending deltas, so a flush always sees deltas and journal
+        # entries that match
+        self._journal_lock = threading.Lock()
+        self._journal = None
+        self._seq = 0
+        self._pending: Dict[int, int] = {}
+        # purchase id -> (journal seq, deltas) for bills not yet committed
+        self._open: Dict[int, Tuple[int, Dict[int, int]]] = {}
+        self._process_lock = None
+
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    # ---------- lifecycle ----------
+
+    def load(self):
+        """Read stock from the database and replay unflushed journal entries."""
+        self._lock_process()
+        with self.engine.connect() as conn:
+            flushed = conn.execute(
+                text("SELECT flushed_seq FROM stock_ledger_state WHERE id = 1")
+            ).scalar() or 0
+            self._stock = {
+                pk: int(stock or 0)
+                for pk, stock in conn.execute(text("SELECT id, available_stock FROM products"))
+            }
+
+        self._seq, self._pending, self._open = flushed, {}, {}
+        unsettled: Dict[int, Dict[int, int]] = {}
+        for entry in self._read_journal():
+            seq = entry["seq"]
+            self._seq = max(self._seq, seq)
+            if "reserve" in entry:
+                unsettled[entry["reserve"]] = {int(pk): d for pk, d in entry["deltas"].items()}
+            elif "commit" in entry:
+                deltas = unsettled.pop(entry["commit"], {})
+                if seq > flushed:
+                    self._add_pending(deltas)
+            elif "release" in entry:
+                unsettled.pop(entry["release"], None)
+
+        # Crashed between reserving and the bill's commit: the bill (and the
+        # whole reservation with it) was saved iff its purchase row exists
+        saved = self._existing_purchases(list(unsettled)) if unsettled else set()
+        for purchase_id, deltas in unsettled.items():
+            if purchase_id in saved:
+                self._add_pending(deltas)
+
+        for pk, delta in self._pending.items():
+            self._stock[pk] = self._stock.get(pk, 0) + delta
+        self._rotate_journal()
+        if unsettled:
+            # Record the outcome, so a later replay never asks the database
+            # again (by then the purchase id may belong to another bill)
+            for purchase_id in unsettled:
+                self._write({"commit" if purchase_id in saved else "release": purchase_id})
+            print(f"[LEDGER] Settled {len(unsettled)} interrupted reservations "
+                  f"({len(saved)} saved, {len(unsettled) - len(saved)} released)")
+        if self._pending:
+            print(f"[LEDGER] Replayed unflushed deltas for {len(self._pending)} products")
+            self.flush()
+
+    def _lock_process(self):
+        if fcntl is None or self._process_lock:
+            return
+        lock = open(f"{self.journal_path}.lock", "a")
+        try:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock.close()
+            raise RuntimeError(
+                f"stock ledger {self.journal_path} is in use by another process; "
+                "the ledger needs the app to run as a single process"
+            )
+        self._process_lock = lock
+
+    def _existing_purchases(self, purchase_ids: List[int]) -> Set[int]:
+        query = text("SELECT id FROM purchases WHERE id IN :ids").bindparams(bindparam("ids", expanding=True))
+        with self.engine.connect() as conn:
+            return {pk for (pk,) in conn.execute(query, {"ids": purchase_ids})}
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="stock-ledger-flush", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the flush thread and write out everything still pending."""
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+        with self._journal_lock:
+            if self._journal:
+                self._journal.close()
+                self._journal = None
+        if self._process_lock:
+            self._process_lock.close()  # releases the flock
+            self._process_lock = None
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"[LEDGER][ERROR] flush failed: {e}")
+
+    # ---------- reservations ----------
+
+    def available(self, product_pk: int) -> int:
+        return self._stock.get(product_pk, 0)
+
+    def reserve(self, quantities: Dict[int, int], purchase_id: int) -> Optional[Shortage]:
+        """Take stock for every product pk in `quantities`, all or nothing, for
+        the (flushed, not yet committed) purchase `purchase_id`. Returns None on
+        success, otherwise the first shortage. Follow with commit() or release()."""
+        with self._locked(quantities):
+            for pk, qty in sorted(quantities.items()):
+                have = self._stock.get(pk, 0)
+                if have < qty:
+                    return pk, have, qty
+            deltas = {pk: -qty for pk, qty in quantities.items()}
+            with self._journal_lock:
+                seq = self._write({"reserve": purchase_id, "deltas": deltas})
+                self._open[purchase_id] = (seq, deltas)
+            for pk, delta in deltas.items():
+                self._stock[pk] = self._stock.get(pk, 0) + delta
+        return None
+
+    def commit(self, purchase_id: int):
+        """The purchase was saved: its reservation becomes a pending delta."""
+        with self._journal_lock:
+            _, deltas = self._open.pop(purchase_id)
+            self._write({"commit": purchase_id})
+            self._add_pending(deltas)
+
+    def release(self, purchase_id: int):
+        """Give back the reservation of a purchase that could not be saved.
+        Does nothing if the purchase holds no reservation."""
+        opened = self._open.get(purchase_id)
+        if opened is None:
+            return
+        deltas = opened[1]
+        with self._locked(deltas):
+            with self._journal_lock:
+                self._open.pop(purchase_id)
+                self._write({"release": purchase_id})
+            for pk, delta in deltas.items():
+                self._stock[pk] = self._stock.get(pk, 0) - delta
+
+    @contextmanager
+    def editing(self, product_pk: int) -> Iterator[None]:
+        """Hold a SKU while an admin edit writes `available_stock` directly.
+
+        Pending deltas are flushed first so the edit starts from the current
+        value; once the block (and its commit) is done the row is re-read, which
+        also covers newly created and deleted products."""
+        with self._locked({product_pk: 0}):
+            self.flush()
+            yield
+            self.refresh(product_pk)
+
+    def refresh(self, product_pk: int):
+        """Re-read one product's stock from the database (e.g. after it was created).
+        Callers hold the SKU lock or own the product exclusively."""
+        with self.engine.connect() as conn:
+            stock = conn.execute(
+                text("SELECT available_stock FROM products WHERE id = :pk"), {"pk": product_pk}
+            ).scalar()
+        if stock is None:
+            self._stock.pop(product_pk, None)
+            return
+        with self._journal_lock:
+            # Bills still in flight, and committed ones not flushed yet, have
+            # taken stock the database does not show yet
+            held = sum(deltas.get(product_pk, 0) for _, deltas in self._open.values())
+            held += self._pending.get(product_pk, 0)
+        self._stock[product_pk] = int(stock) + held
+
+    def _sku_lock(self, pk: int) -> threading.Lock:
+        with self._locks_guard:
+            return self._sku_locks.setdefault(pk, threading.Lock())
+
+    @contextmanager
+    def _locked(self, quantities: Dict[int, int]) -> Iterator[None]:
+        # Always lock in pk order so concurrent multi-SKU bills cannot deadlock
+        locks = [self._sku_lock(pk) for pk in sorted(quantities)]
+        for lock in locks:
+            lock.acquire()
+        try:
+            yield
+        finally:
+            for lock in reversed(locks):
+                lock.release()
+
+    def _write(self, entry: Dict) -> int:
+        # Caller holds _journal_lock
+        self._seq += 1
+        self._journal.write(json.dumps({"seq": self._seq, **entry}) + "\n")
+        self._journal.flush()
+        if self.fsync:
+            os.fsync(self._journal.fileno())
+        return self._seq
+
+    def _add_pending(self, deltas: Dict[int, int]):
+        # Caller holds _journal_lock (or is single-threaded in load())
+        for pk, delta in deltas.items():
+            self._pending[pk] = self._pending.get(pk, 0) + delta
+
+    # ---------- flushing ----------
+
+    def flush(self) -> int:
+        """Apply pending deltas to `products` in one transaction.
+        Returns the number of products updated."""
+        with self._flush_lock:
+            with self._journal_lock:
+                if not self._pending:
+                    return 0
+                deltas, self._pending = self._pending, {}
+                upto = self._seq
+                self._rotate_journal()
+
+            rows = [{"pk": pk, "delta": d} for pk, d in deltas.items() if d]
+            try:
+                with self.engine.begin() as conn:
+                    if rows:
+                        conn.execute(
+                            text("UPDATE products SET available_stock = available_stock + :delta WHERE id = :pk"),
+                            rows,
+                        )
+                    conn.execute(
+                        text("UPDATE stock_ledger_state SET flushed_seq = :seq WHERE id = 1"),
+                        {"seq": upto},
+                    )
+            except Exception:
+                # Keep the deltas (and their journal segment) for the next attempt
+                with self._journal_lock:
+                    for pk, d in deltas.items():
+                        self._pending[pk] = self._pending.get(pk, 0) + d
+                raise
+
+            for path in self._segments():
+                if self._segment_seq(path) <= upto:
+                    os.remove(path)
+            return len(rows)
+
+    # ---------- journal files ----------
+    # The live journal is `<journal>`; each flush renames it to `<journal>.<seq>`
+    # and deletes segments once the database checkpoint covers them. Open
+    # reservations are copied into every new journal, so deleting old
+    # segments never drops one.
+
+    def _segments(self):
+        paths = glob.glob(f"{glob.escape(str(self.journal_path))}.*")
+        return sorted((p for p in paths if self._segment_seq(p) >= 0), key=self._segment_seq)
+
+    @staticmethod
+    def _segment_seq(path: str) -> int:
+        suffix = path.rsplit(".", 1)[-1]
+        return int(suffix) if suffix.isdigit() else -1
+
+    def _read_journal(self):
+        for path in self._segments() + [str(self.journal_path)]:
+            if not os.path.exists(path):
+                continue
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        break  # torn last line from a crash mid-write
+
+    def _rotate_journal(self):
+        # Caller holds _journal_lock (or is single-threaded in load())
+        if self._journal:
+            self._journal.close()
+        if self.journal_path.exists() and self.journal_path.stat().st_size:
+            os.replace(self.journal_path, f"{self.journal_path}.{self._seq}")
+        self._journal = open(self.journal_path, "a", encoding="utf-8")
+        for purchase_id, (seq, deltas) in self._open.items():
+            self._journal.write(json.dumps({"seq": seq, "reserve": purchase_id, "deltas": deltas}) + "\n")
+        self._journal.flush()
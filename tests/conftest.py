@@ -0,0 +1,30 @@
+# tests/conftest.py
+import os
+import atexit
+import shutil
+import tempfile
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+# database.py binds its engine on import: point it at a throw-away database
+# before any test module imports the app.
+_tmpdir = tempfile.mkdtemp(prefix="billing-tests-")
+atexit.register(shutil.rmtree, _tmpdir, ignore_errors=True)
+os.environ["BILLING_DATABASE_URL"] = f"sqlite:///{os.path.join(_tmpdir, 'billing.db')}"
+
+
+@pytest.fixture
+def engine(tmp_path):
+    """A migrated database of its own, for tests that must not share state."""
+    from migrations import migrate
+    engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}", connect_args={"check_same_thread": False})
+    migrate(engine)
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def session_factory(engine):
+    return sessionmaker(bind=engine, autoflush=False, autocommit=False)
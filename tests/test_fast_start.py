@@ -0,0 +1,54 @@
+# tests/test_fast_start.py
+import os
+import sys
+import subprocess
+from pathlib import Path
+
+import pytest
+from sqlalchemy import event
+
+from migrations import migrate
+
+ROOT = Path(__file__).resolve().parents[1]
+
+
+def _python(code: str, tmp_path, **env) -> str:
+    """Run `code` in a fresh interpreter against a throw-away database."""
+    result = subprocess.run(
+        [sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True,
+        env={**os.environ, "BILLING_DATABASE_URL": f"sqlite:///{tmp_path / 'app.db'}", **env},
+    )
+    return result.stdout
+
+
+def test_importing_the_app_does_not_load_the_mail_stack(tmp_path):
+    out = _python(
+        "import sys, app; print(sorted(m for m in ('smtplib', 'mail_notification') if m in sys.modules))",
+        tmp_path,
+    )
+    assert out.splitlines()[-1] == "[]"
+
+
+def test_migrate_on_current_schema_only_reads_the_version(engine, monkeypatch):
+    statements = []
+    event.listen(engine, "before_cursor_execute",
+                 lambda conn, cursor, statement, *args: statements.append(statement))
+    monkeypatch.setattr(engine, "begin", lambda *a, **kw: pytest.fail("opened a write transaction"))
+
+    migrate(engine)
+
+    assert statements == ["PRAGMA user_version"]
+
+
+def test_fast_start_caches_every_template(tmp_path):
+    cache = tmp_path / "jinja_cache"
+    out = _python(
+        "from fastapi.testclient import TestClient\n"
+        "import app\n"
+        "with TestClient(app.app):\n"
+        "    pass\n",
+        tmp_path, BILLING_FAST_START="1", BILLING_JINJA_CACHE=str(cache),
+    )
+    templates = list((ROOT / "templates").glob("*.html"))
+    assert f"Precompiled {len(templates)} templates" in out
+    assert len(list(cache.iterdir())) == len(templates)
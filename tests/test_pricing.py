@@ -0,0 +1,48 @@
+# tests/test_pricing.py
+import random
+
+import pytest
+
+import pricing
+from pricing import NUMPY_MIN_LINES, price_lines, to_paise
+
+
+@pytest.mark.parametrize("lines, tax", [
+    ([(0.1, 3, 18.0)], [5]),        # 30 paise * 18% = 5.4 -> 5
+    ([(0.25, 1, 18.0)], [5]),       # 4.5 -> 5, half-up
+    ([(10.0, 1, 12.5)], [125]),
+    ([(5.0, 2, 0.0)], [0]),
+])
+def test_tax_is_rounded_half_up_per_line(lines, tax):
+    assert price_lines(lines).tax == tax
+
+
+def test_to_paise_rounds_half_up():
+    assert to_paise(1.005) == 101  # 1.00499999... as a binary float
+    assert to_paise(0.125) == 13
+    assert to_paise(None) == 0
+
+
+def test_net_is_the_sum_of_line_totals():
+    priced = price_lines([(0.1, 3, 18.0), (19.99, 7, 5.0), (0.33, 3, 12.0), (250.0, 1, 28.0)])
+    assert priced.net == sum(priced.total)
+    assert priced.net == priced.subtotal + priced.total_tax
+    assert priced.subtotal == sum(priced.amount)
+    assert priced.total_tax == sum(priced.tax)
+
+
+def test_empty_batch():
+    assert price_lines([]) == ([], [], [], 0, 0, 0)
+
+
+def test_numpy_path_matches_python_path():
+    pytest.importorskip("numpy")
+    rng = random.Random(7)
+    lines = [(round(rng.uniform(0, 5000), 2), rng.randrange(0, 50), rng.choice([0, 5, 12, 12.5, 18, 28]))
+             for _ in range(NUMPY_MIN_LINES + 17)]
+    prices = [p for p, _, _ in lines]
+    quantities = [q for _, q, _ in lines]
+    rates = [r for _, _, r in lines]
+    expected = pricing._price_python(prices, quantities, rates)
+    assert pricing._price_numpy(prices, quantities, rates) == expected
+    assert price_lines(lines) == expected  # large enough to take the NumPy path
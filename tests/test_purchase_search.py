@@ -0,0 +1,115 @@
+# tests/test_purchase_search.py
+from datetime import datetime
+
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+
+from migrations import migrate
+from models import Product, Purchase, PurchaseItem
+from purchase_search import MAX_MATCHES, MAX_SCANNED, rebuild_search_index, search_purchases
+
+
+@pytest.fixture
+def db(engine, session_factory):
+    """150 purchases (ids 1..150), alternating Pen / Notebook, indexed."""
+    session = session_factory()
+    pen = Product(product_id="P1001", name="Pen", available_stock=10, price_per_unit=10.0, tax_percentage=5.0)
+    notebook = Product(product_id="P1002", name="Notebook", available_stock=10, price_per_unit=50.0, tax_percentage=12.0)
+    session.add_all([pen, notebook])
+    for n in range(1, 151):
+        purchase = Purchase(customer_email=f"customer{n}@example.com", total_amount=10.5, paid_amount=20.0,
+                            balance=9.5, purchase_time=datetime(2025, 1, 1))
+        purchase.items.append(PurchaseItem(product=pen if n % 2 else notebook, quantity=1))
+        session.add(purchase)
+    session.commit()
+    with engine.begin() as conn:
+        rebuild_search_index(conn)
+    yield session
+    session.close()
+
+
+def _ids(rows):
+    return [r["id"] for r in rows]
+
+
+@pytest.mark.parametrize("query", ["#123", "123", "#123 customer123"])
+def test_invoice_number_is_listed_first(db, query):
+    rows, total = search_purchases(db, query)
+    assert total >= 1 and _ids(rows)[0] == 123
+
+
+def test_short_invoice_number_is_an_exact_lookup(db):
+    rows, total = search_purchases(db, "#12")
+    assert (_ids(rows), total) == ([12], 1)
+
+
+def test_partial_email_and_product_name(db):
+    rows, total = search_purchases(db, "customer14 noteb", per_page=200)
+    assert sorted(_ids(rows)) == [14, 140, 142, 144, 146, 148]
+    assert total == 6
+
+
+def test_short_terms_filter_the_matches(db):
+    rows, total = search_purchases(db, "Pen 17", per_page=200)
+    assert sorted(_ids(rows)) == [17, 117]
+    assert total == 2
+
+
+def _bulk_purchases(engine, count):
+    """`count` purchases of one Pen each, indexed, without going through the ORM."""
+    with engine.begin() as conn:
+        conn.execute(text(
+            "INSERT INTO products (product_id, name, available_stock, price_per_unit, tax_percentage) "
+            "VALUES ('P1001', 'Pen', 10, 10.0, 5.0)"))
+        conn.execute(text("""
+            WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < :count)
+            INSERT INTO purchases (id, customer_email, total_amount, paid_amount, balance, purchase_time)
+            SELECT i, 'customer' || i || '@example.com', 10.5, 20.0, 9.5, '2025-01-01 00:00:00' FROM n
+        """), {"count": count})
+        conn.execute(text("INSERT INTO purchase_items (purchase_id, product_id, quantity) SELECT id, 1, 1 FROM purchases"))
+        rebuild_search_index(conn)
+
+
+def test_common_term_is_counted_up_to_the_cap(engine, session_factory):
+    _bulk_purchases(engine, MAX_MATCHES + 50)
+    with session_factory() as session:
+        rows, total = search_purchases(session, "pen", per_page=5)
+        assert total == MAX_MATCHES + 1
+        # the newest matches are ranked; the exact invoice is kept even when older
+        assert _ids(rows)[0] > 50
+        rows, _ = search_purchases(session, "#7 pen")
+        assert _ids(rows)[0] == 7
+
+
+def _vm_steps(session, query):
+    """SQLite VM instructions (in thousands) spent on one search."""
+    steps = [0]
+
+    def tick():
+        steps[0] += 1
+        return 0
+
+    raw = session.connection().connection.driver_connection
+    raw.set_progress_handler(tick, 1000)
+    try:
+        search_purchases(session, query)
+    finally:
+        raw.set_progress_handler(None, 1000)
+    return steps[0]
+
+
+@pytest.mark.parametrize("query", ["pen", "pen 17", "customer1"])
+def test_search_cost_does_not_grow_with_matches(tmp_path, query):
+    """Like the query-plan audit's threshold: scale the data up and check the
+    work per search stays flat (a full count or rank would grow 4x)."""
+    costs = []
+    for count in (MAX_SCANNED + 2_000, 4 * MAX_SCANNED):
+        engine = create_engine(f"sqlite:///{tmp_path / f'{count}.db'}")
+        migrate(engine)
+        _bulk_purchases(engine, count)
+        with sessionmaker(bind=engine)() as session:
+            costs.append(_vm_steps(session, query))
+        engine.dispose()
+    small, large = costs
+    assert large <= small * 1.5 + 5, costs
@@ -0,0 +1,78 @@
+# tests/test_query_plans.py
+"""query_plan_audit under pytest: one case per statement the app issues."""
+import sqlite3
+
+import pytest
+
+import query_plan_audit as audit
+
+# Seeds the test database and drives every route once, at collection time
+CAPTURED = audit.collect()
+
+
+@pytest.fixture(scope="module")
+def raw():
+    from database import engine
+    conn = engine.raw_connection()
+    yield conn
+    conn.close()
+
+
+@pytest.fixture(scope="module")
+def table_rows(raw):
+    return audit.table_sizes(raw)
+
+
+def _failing(raw, table_rows):
+    return [
+        (label, " ".join(statement.split()), problems)
+        for label, statement, params in CAPTURED
+        for problems in [audit.check_plan(raw, label, statement, params, table_rows)[0]]
+        if problems
+    ]
+
+
+@pytest.mark.parametrize(
+    "label, statement, params", CAPTURED,
+    ids=[f"{n:02d} {label}" for n, (label, _, _) in enumerate(CAPTURED)],
+)
+def test_query_plan(raw, table_rows, label, statement, params):
+    problems, details = audit.check_plan(raw, label, statement, params, table_rows)
+    assert not problems, "\n".join([" ".join(statement.split()), *details])
+
+
+def test_every_allowed_plan_is_used():
+    unused = [
+        key for key in audit.ALLOWED_PLANS
+        if not any(label == key[0] and key[1] in " ".join(statement.split())
+                   for label, statement, _ in CAPTURED)
+    ]
+    assert not unused
+
+
+def test_insert_select_reads_are_checked():
+    # index_purchase / reindex_product: only their SELECT part is captured
+    statements = [" ".join(statement.split()) for _, statement, _ in CAPTURED]
+    assert not [s for s in statements if s.upper().startswith("INSERT")]
+    assert any(s.startswith("SELECT p.id, p.id, p.customer_email") and "product_id = ?" in s
+               for s in statements)
+
+
+@pytest.mark.parametrize("index", [
+    "ix_purchases_customer_norm_time",
+    "ix_products_name_norm",
+    "ix_purchases_purchase_time",
+    "ix_purchase_items_product_purchase",
+])
+def test_missing_index_is_reported(table_rows, index):
+    # A fresh connection: cached EXPLAIN statements are not re-planned after DDL
+    from database import engine
+    conn = sqlite3.connect(engine.url.database, isolation_level=None)
+    try:
+        conn.execute("BEGIN")
+        conn.execute(f"DROP INDEX {index}")
+        failing = _failing(conn, table_rows)
+        conn.execute("ROLLBACK")
+    finally:
+        conn.close()
+    assert failing, f"dropping {index} went unnoticed"
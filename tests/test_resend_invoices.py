@@ -0,0 +1,137 @@
+# tests/test_resend_invoices.py
+from datetime import datetime
+from types import SimpleNamespace
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import resend_invoices
+from models import Product, Purchase, PurchaseItem
+
+
+@pytest.fixture
+def purchases(session_factory, monkeypatch):
+    """Three purchases on 2025-01-01..03, read through the test database."""
+    monkeypatch.setattr(resend_invoices, "SessionLocal", session_factory)
+    db = session_factory()
+    try:
+        pen = Product(product_id="P1001", name="Pen", available_stock=10, price_per_unit=10.0, tax_percentage=5.0)
+        db.add(pen)
+        for day in (1, 2, 3):
+            purchase = Purchase(customer_email=f"c{day}@example.com", total_amount=10.5, paid_amount=20.0,
+                                balance=9.5, purchase_time=datetime(2025, 1, day, 12))
+            purchase.items.append(PurchaseItem(product=pen, quantity=1))
+            db.add(purchase)
+        db.commit()
+        return [p.id for p in db.query(Purchase).order_by(Purchase.id)]
+    finally:
+        db.close()
+
+
+@pytest.fixture
+def outbox(monkeypatch):
+    """Records sends; ids in outbox.failing raise like an SMTP outage."""
+    class Outbox(list):
+        failing = set()
+
+    box = Outbox()
+
+    def send(to_email, subject, html):
+        purchase_id = int(subject.split("#")[1])
+        if purchase_id in box.failing:
+            raise OSError("SMTP down")
+        box.append(purchase_id)
+
+    monkeypatch.setattr(resend_invoices, "_send_smtp_email", send)
+    return box
+
+
+def _run(tmp_path, **kw):
+    return resend_invoices.resend_invoices(
+        start=datetime(2025, 1, 1), end=datetime(2025, 1, 4),
+        state_dir=tmp_path / "state", progress=lambda *a: None, **kw,
+    )
+
+
+def test_interrupted_run_resumes_then_clears_state(tmp_path, purchases, outbox):
+    outbox.failing = {purchases[1]}
+    summary = _run(tmp_path)
+    assert summary["sent"] == 2 and list(summary["failed"]) == [purchases[1]]
+    assert len(list((tmp_path / "state").iterdir())) == 1
+
+    outbox.failing = set()
+    summary = _run(tmp_path)
+    assert summary["skipped"] == 2 and summary["sent"] == 1
+    assert outbox == [purchases[0], purchases[2], purchases[1]]
+    assert not list((tmp_path / "state").iterdir())  # finished: nothing to resume
+
+
+def test_completed_run_does_not_suppress_later_jobs(tmp_path, purchases, outbox):
+    _run(tmp_path)
+    summary = _run(tmp_path)
+    assert summary["skipped"] == 0 and summary["sent"] == 3
+
+
+def test_state_is_scoped_to_the_selection(tmp_path, purchases, outbox):
+    outbox.failing = {purchases[1]}
+    _run(tmp_path)
+    outbox.failing = set()
+    # A different selection that overlaps the interrupted one sends everything
+    summary = resend_invoices.resend_invoices(
+        customer="c1@example.com", state_dir=tmp_path / "state", progress=lambda *a: None,
+    )
+    assert summary["skipped"] == 0 and summary["sent"] == 1
+
+
+def test_no_resume_sends_everything(tmp_path, purchases, outbox):
+    outbox.failing = {purchases[1]}
+    _run(tmp_path)
+    outbox.failing = set()
+    summary = _run(tmp_path, resume=False)
+    assert summary["skipped"] == 0 and summary["sent"] == 3
+
+
+def test_deleted_product_fails_only_that_purchase(tmp_path, session_factory, purchases, outbox):
+    db = session_factory()
+    try:
+        eraser = Product(product_id="P1003", name="Eraser", available_stock=5, price_per_unit=5.0, tax_percentage=0.0)
+        purchase = db.get(Purchase, purchases[0])
+        purchase.items.append(PurchaseItem(product=eraser, quantity=1))
+        db.commit()
+        db.delete(eraser)  # like /admin/products/{id}/delete: the line stays behind
+        db.commit()
+    finally:
+        db.close()
+
+    summary = _run(tmp_path)
+    assert summary["selected"] == 3 and summary["sent"] == 2
+    assert "no longer exists" in summary["failed"][purchases[0]]
+    assert outbox == purchases[1:]
+
+
+def test_process_pool_renders_like_in_process(tmp_path, purchases, outbox):
+    summary = _run(tmp_path, workers=2)
+    assert summary["sent"] == 3 and sorted(outbox) == purchases
+
+
+def test_render_window_bounds_submitted_renders(monkeypatch):
+    class CountingPool(ThreadPoolExecutor):
+        submitted = 0
+
+        def __init__(self, max_workers, mp_context=None):
+            super().__init__(max_workers)
+
+        def submit(self, fn, *args):
+            CountingPool.submitted += 1
+            return super().submit(fn, *args)
+
+    monkeypatch.setattr(resend_invoices, "ProcessPoolExecutor", CountingPool)
+    monkeypatch.setattr(resend_invoices, "_render_invoice", lambda s: (s.id, "", ""))
+    snapshots = [SimpleNamespace(id=n) for n in range(50)]
+
+    rendered = []
+    for purchase_id, _, _ in resend_invoices.render_invoices(snapshots, workers=2, window=4):
+        # at most 4 submitted beyond what has been consumed so far
+        assert CountingPool.submitted <= len(rendered) + 4
+        rendered.append(purchase_id)
+    assert rendered == list(range(50))
@@ -0,0 +1,185 @@
+# tests/test_stock_ledger.py
+"""Crash recovery of the write-behind stock ledger. Crashes are real: a child
+process runs the ledger and dies with os._exit() at the chosen point."""
+import os
+import sys
+import subprocess
+from pathlib import Path
+
+import pytest
+from sqlalchemy import text
+
+from models import Product
+from stock_ledger import StockLedger
+
+ROOT = Path(__file__).resolve().parents[1]
+PEN = 1  # products.id of the only product, 100 in stock
+
+CHILD_PRELUDE = """
+import os, sys
+from sqlalchemy import create_engine, event, text
+from stock_ledger import StockLedger
+
+engine = create_engine(sys.argv[1])
+ledger = StockLedger(engine, journal_path=sys.argv[2], flush_interval=3600)
+ledger.load()
+
+def bill(purchase_id, qty, saved=True):
+    # generate_bill order: purchase row, reservation, commit, ledger.commit()
+    if saved:
+        with engine.begin() as conn:
+            conn.execute(text(
+                "INSERT INTO purchases (id, customer_email, total_amount, paid_amount, balance, purchase_time) "
+                "VALUES (:id, 'test@example.com', 0, 0, 0, '2025-01-01')"), {"id": purchase_id})
+    assert ledger.reserve({1: qty}, purchase_id) is None
+
+def crash_after(prefix):
+    # Die once the statement ran, before its transaction commits
+    @event.listens_for(engine, "after_cursor_execute")
+    def _die(conn, cursor, statement, *args):
+        if statement.lstrip().startswith(prefix):
+            os._exit(1)
+"""
+
+
+@pytest.fixture
+def journal(tmp_path):
+    return tmp_path / "stock.journal"
+
+
+@pytest.fixture
+def stock(engine, session_factory):
+    """Seeds the pen; returns a reader of its stock in the database."""
+    db = session_factory()
+    db.add(Product(id=PEN, product_id="P1001", name="Pen", available_stock=100,
+                   price_per_unit=10.0, tax_percentage=5.0))
+    db.commit()
+    db.close()
+
+    def read():
+        with engine.connect() as conn:
+            return conn.execute(text("SELECT available_stock FROM products WHERE id = :pk"), {"pk": PEN}).scalar()
+    return read
+
+
+def _crash(engine, journal, body):
+    env = {**os.environ, "PYTHONPATH": str(ROOT)}
+    result = subprocess.run(
+        [sys.executable, "-c", CHILD_PRELUDE + body, str(engine.url), str(journal)],
+        cwd=ROOT, env=env, capture_output=True, text=True,
+    )
+    assert result.returncode == 1, result.stderr  # died at the crash point
+
+
+def _reload(engine, journal) -> StockLedger:
+    ledger = StockLedger(engine, journal_path=journal, flush_interval=3600)
+    ledger.load()
+    return ledger
+
+
+def test_crash_mid_flush_is_replayed_on_load(engine, journal, stock):
+    _crash(engine, journal, """
+for purchase_id in (1, 2, 3):
+    bill(purchase_id, 2)
+    ledger.commit(purchase_id)
+crash_after("UPDATE products")
+ledger.flush()
+""")
+    assert stock() == 100  # the flush transaction never committed
+
+    ledger = _reload(engine, journal)
+    assert ledger.available(PEN) == 94
+    ledger.stop()
+    assert stock() == 94
+
+
+def test_crash_between_reserve_and_commit_is_settled_by_the_database(engine, journal, stock):
+    _crash(engine, journal, """
+bill(1, 3)                # saved, but the process died before ledger.commit()
+bill(2, 5, saved=False)   # died before the purchase was saved
+os._exit(1)
+""")
+    ledger = _reload(engine, journal)
+    assert ledger.available(PEN) == 97
+    ledger.stop()
+    assert stock() == 97
+
+
+def test_settled_reservation_is_not_revisited_when_its_id_is_reused(engine, journal, stock):
+    _crash(engine, journal, """
+bill(1, 5, saved=False)
+os._exit(1)
+""")
+    ledger = _reload(engine, journal)  # released; nothing to flush
+    assert ledger.available(PEN) == 100
+    ledger.stop()
+
+    # The next purchase gets id 1; the old reservation must stay released
+    with engine.begin() as conn:
+        conn.execute(text(
+            "INSERT INTO purchases (id, customer_email, total_amount, paid_amount, balance, purchase_time) "
+            "VALUES (1, 'other@example.com', 0, 0, 0, '2025-01-02')"))
+    ledger = _reload(engine, journal)
+    assert ledger.available(PEN) == 100
+    ledger.stop()
+
+
+def test_open_reservation_survives_journal_rotation(engine, journal, stock):
+    _crash(engine, journal, """
+bill(1, 4)                      # stays open across several flushes
+for purchase_id in (2, 3, 4):
+    bill(purchase_id, 1)
+    ledger.commit(purchase_id)
+    ledger.flush()              # rotates the journal and deletes old segments
+ledger.commit(1)
+os._exit(1)
+""")
+    assert stock() == 97
+    ledger = _reload(engine, journal)
+    assert ledger.available(PEN) == 93
+    ledger.stop()
+    assert stock() == 93
+
+
+def test_release_gives_stock_back(engine, journal, stock):
+    ledger = _reload(engine, journal)
+    assert ledger.reserve({PEN: 30}, 1) is None
+    assert ledger.reserve({PEN: 80}, 2) == (PEN, 70, 80)
+    ledger.release(1)
+    assert ledger.available(PEN) == 100
+    ledger.stop()
+    assert stock() == 100
+
+
+def test_admin_edit_keeps_stock_held_by_bills_in_flight(engine, journal, stock):
+    ledger = _reload(engine, journal)
+    assert ledger.reserve({PEN: 5}, 1) is None
+    with ledger.editing(PEN):
+        with engine.begin() as conn:
+            conn.execute(text("UPDATE products SET available_stock = 50 WHERE id = :pk"), {"pk": PEN})
+    assert ledger.available(PEN) == 45
+    ledger.commit(1)
+    ledger.stop()
+    assert stock() == 45
+
+
+def test_bill_committed_during_admin_edit_is_kept(engine, journal, stock):
+    ledger = _reload(engine, journal)
+    assert ledger.reserve({PEN: 5}, 1) is None
+    with ledger.editing(PEN):
+        with engine.begin() as conn:
+            conn.execute(text("UPDATE products SET available_stock = 50 WHERE id = :pk"), {"pk": PEN})
+        ledger.commit(1)  # the bill finishes while the edit is open
+    assert ledger.available(PEN) == 45
+    ledger.stop()
+    assert stock() == 45
+
+
+def test_second_ledger_on_the_same_journal_is_refused(engine, journal, stock):
+    ledger = _reload(engine, journal)
+    try:
+        with pytest.raises(RuntimeError, match="single process"):
+            _reload(engine, journal)
+    finally:
+        ledger.stop()
+    _reload(engine, journal).stop()  # free again once the first one stopped
@@ -0,0 +1,40 @@
+# tests/test_views.py
+from datetime import datetime
+
+import pytest
+from fastapi.testclient import TestClient
+
+import app as billing_app
+from models import Product, Purchase, PurchaseItem
+
+
+@pytest.fixture
+def client(session_factory):
+    """The app on a database of its own (startup hooks are not run)."""
+    def get_db():
+        db = session_factory()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    billing_app.app.dependency_overrides[billing_app.get_db] = get_db
+    yield TestClient(billing_app.app)
+    billing_app.app.dependency_overrides.clear()
+
+
+def test_product_drill_down_skips_lines_of_deleted_products(client, session_factory):
+    with session_factory() as db:
+        pen = Product(product_id="P1001", name="Pen", available_stock=10, price_per_unit=10.0, tax_percentage=5.0)
+        eraser = Product(product_id="P1003", name="Eraser", available_stock=10, price_per_unit=5.0, tax_percentage=0.0)
+        purchase = Purchase(customer_email="a@example.com", total_amount=25.5, paid_amount=30.0,
+                            balance=4.5, purchase_time=datetime(2025, 1, 1))
+        purchase.items += [PurchaseItem(product=pen, quantity=2), PurchaseItem(product=eraser, quantity=1)]
+        db.add(purchase)
+        db.commit()
+        db.delete(eraser)  # like /admin/products/{id}/delete: the line stays behind
+        db.commit()
+
+    resp = client.get("/products", params={"product": "pen"})
+    assert resp.status_code == 200
+    assert "21.00" in resp.text  # 2 x ₹10 + 5% tax, the pen line only